@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+"""
+Benchmarks for nytcampfin, run against the bundled API stub
+
+    $ python bench.py                          # everything
+    $ python bench.py overhead pagination --delay 0.02 --padding 500
+    $ python bench.py --json before.json       # save results ...
+    $ python bench.py --json after.json
+    $ python bench.py --compare before.json after.json
+
+Every benchmark returns a flat dict of metrics whose names end in their
+unit; --json writes them, with the options and environment they were
+measured under, for --compare to diff between commits.
+"""
+import gc
+import os
+import sys
+import json
+import time
+import shutil
+import timeit
+import argparse
+import platform
+import tempfile
+import subprocess
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import asyncio
+    from nytcampfin_async import AsyncNytCampfin, collect
+except (ImportError, SyntaxError):
+    AsyncNytCampfin = None
+
+import nytcampfin
+from nytcampfin import NytCampfin, MemoryCache, SqliteCache, DirectoryCache
+from nytcampfin_stub import StubServer
+
+def fake_record(i):
+    "An independent expenditure shaped like the API's"
+    return {
+        'fec_committee_id': 'C%08d' % i,
+        'committee': '/committees/C%08d.json' % i,
+        'committee_name': 'AMERICANS FOR A BETTER TOMORROW, TOMORROW',
+        'candidate': '/candidates/P%08d.json' % i,
+        'candidate_name': 'ROMNEY, MITT',
+        'office': 'President',
+        'state': 'MA',
+        'district': None,
+        'amount': 12345.67 + i,
+        'date': '2012-07-03',
+        'date_received': '2012-07-05',
+        'support_or_oppose': 'O' if i % 2 else 'S',
+        'purpose': 'TV AD BUY - "PRODUCTION AND PLACEMENT"',
+        'payee': 'MENTZER MEDIA SERVICES',
+        'fec_filing_id': 790000 + i,
+        'fec_uri': 'http://query.nictusa.com/cgi-bin/dcdev/forms/C%08d/%d/' % (i, 790000 + i),
+        'transaction_id': 'SE.%d' % i,
+        'unique_id': 'SE.%d.%d' % (i, 790000 + i),
+        'amendment': False,
+        'filing_date': '2012-07-05',
+        'fec_candidate_id': 'P%08d' % i,
+        'prior_payments': 0.0,
+    }
+
+def fake_page(records=nytcampfin.PAGE_SIZE, offset=0):
+    return {
+        'status': 'OK',
+        'copyright': 'Copyright (c) 2012 The New York Times Company.  All Rights Reserved.',
+        'base_uri': 'http://api.nytimes.com/svc/elections/us/v3/finances/2012/',
+        'cycle': 2012,
+        'num_results': records,
+        'results': [fake_record(offset + i) for i in range(records)],
+    }
+
+def per_call(func, number):
+    "Best of five runs, in microseconds per call"
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+def stub_client(server, **options):
+    return NytCampfin('bench-key', base_uri=server.base_uri, **options)
+
+def bench_decode(server, options, number=2000):
+    "Cost of decoding one page, for each available decoder"
+    body = json.dumps(fake_page()).encode('utf-8')
+    decoders = [('json', nytcampfin._json_loads)]
+    if nytcampfin.orjson is not None:
+        decoders.append(('orjson', nytcampfin.orjson.loads))
+    if nytcampfin.ujson is not None:
+        decoders.append(('ujson', nytcampfin.ujson.loads))
+    decoders.append(('lazy', nytcampfin.lazy_loads))
+    if nytcampfin.loads is not nytcampfin._json_loads:
+        decoders.append(('lazy+json', lambda body: nytcampfin.lazy_loads(body, nytcampfin._json_loads)))
+
+    results = {}
+    for name, decode in decoders:
+        results[name + '.all_us'] = per_call(lambda: list(decode(body)['results']), number)
+        results[name + '.first_us'] = per_call(lambda: decode(body)['results'][0], number)
+    return results
+
+def bench_overhead(server, options, number=10, rounds=101):
+    """
+    What the client adds to a request: a cache hit is pure client cost, and
+    an uncached call is compared with a bare transport.get of the same URL.
+    The stub answers at once, whatever --delay says, and the two are timed
+    in alternating rounds; overhead is the median difference of a round.
+    """
+    finance = stub_client(server)
+    finance.committees.get('C00490045')
+    hit = per_call(lambda: finance.committees.get('C00490045'), 2000)
+
+    uncached = stub_client(server, cache=False, validators=False, inflight=False)
+    url = server.base_uri + '/2012/committees/C00490045.json'
+    params = {'offset': 0, 'api-key': 'bench-key'}
+    delay, jitter = server.delay, server.jitter
+    server.delay = server.jitter = 0
+    try:
+        timings = []
+        for i in range(rounds):
+            bare = timeit.timeit(lambda: uncached.transport.get(url, params=params), number=number)
+            call = timeit.timeit(lambda: uncached.committees.get('C00490045'), number=number)
+            timings.append((bare / number * 1e6, call / number * 1e6))
+    finally:
+        server.delay, server.jitter = delay, jitter
+    differences = sorted(call - bare for bare, call in timings)
+    return {
+        'cache_hit_us': hit,
+        'transport_us': min(bare for bare, call in timings),
+        'uncached_call_us': min(call for bare, call in timings),
+        'overhead_us': differences[len(differences) // 2],
+    }
+
+def _pages_per_s(run, pages):
+    "Best of three, as pages per second"
+    best = None
+    for i in range(3):
+        start = time.time()
+        run()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return pages / best
+
+def bench_pagination(server, options):
+    "Pages per second walking one paged endpoint, sequentially and concurrently"
+    pages = options.pages
+    results = {}
+
+    def walk(**kwargs):
+        finance = stub_client(server, cache=False, validators=False)
+        method = finance.committees.contributions
+        if 'concurrency' in kwargs:
+            records = list(finance.bulk(method, 'C00381277', **kwargs))
+        else:
+            records = list(finance.paginate(method, 'C00381277', **kwargs))
+        finance.transport.close()
+        assert len(records) == server.total
+
+    results['sequential.pages_per_s'] = _pages_per_s(walk, pages)
+    results['prefetch.pages_per_s'] = _pages_per_s(lambda: walk(prefetch=True), pages)
+    results['threaded.pages_per_s'] = _pages_per_s(
+        lambda: walk(concurrency=nytcampfin.CONCURRENCY), pages)
+
+    if AsyncNytCampfin is not None:
+        def walk_async():
+            loop = asyncio.new_event_loop()
+            finance = AsyncNytCampfin('bench-key', base_uri=server.base_uri,
+                                      cache=False, validators=False)
+            try:
+                records = collect(loop, finance.bulk(
+                    finance.committees.contributions, 'C00381277',
+                    concurrency=nytcampfin.CONCURRENCY))
+                assert len(records) == server.total
+            finally:
+                loop.run_until_complete(finance.close())
+                loop.close()
+        results['async.pages_per_s'] = _pages_per_s(walk_async, pages)
+    return results
+
+def bench_cache(server, options, number=2000):
+    "Latency of a call answered from each cache backend"
+    tmpdir = tempfile.mkdtemp()
+    try:
+        backends = (
+            ('memory', MemoryCache()),
+            ('sqlite', SqliteCache(os.path.join(tmpdir, 'cache.sqlite'))),
+            ('directory', DirectoryCache(os.path.join(tmpdir, 'cache'))),
+        )
+        results = {}
+        for name, cache in backends:
+            finance = stub_client(server, cache=cache)
+            finance.committees.contributions('C00381277')
+            results[name + '.hit_us'] = per_call(
+                lambda: finance.committees.contributions('C00381277'), number)
+        return results
+    finally:
+        shutil.rmtree(tmpdir)
+
+def allocated(build):
+    "Bytes still allocated by whatever build() returns"
+    gc.collect()
+    tracemalloc.start()
+    try:
+        data = build()
+        current = tracemalloc.get_traced_memory()[0]
+        del data
+        return current
+    finally:
+        tracemalloc.stop()
+
+def bench_memory(server, options, records=100000):
+    "Memory held by 100k independent expenditures, as dicts and as records"
+    if tracemalloc is None:
+        return {}
+    body = json.dumps(fake_page()).encode('utf-8')
+    pages = records // nytcampfin.PAGE_SIZE
+
+    def dicts():
+        return [r for i in range(pages) for r in nytcampfin.loads(body)['results']]
+
+    def typed():
+        record = nytcampfin.IndependentExpenditure.from_dict
+        return [record(r) for i in range(pages) for r in nytcampfin.loads(body)['results']]
+
+    return {
+        'dict.bytes_per_100k': allocated(dicts) * 100000.0 / records,
+        'typed.bytes_per_100k': allocated(typed) * 100000.0 / records,
+    }
+
+STARTUP = '''
+import json, sys, time
+start = time.time()
+import nytcampfin
+imported = time.time()
+finance = nytcampfin.NytCampfin('bench-key', base_uri=sys.argv[1])
+constructed = time.time()
+finance.filings.today()
+fetched = time.time()
+print(json.dumps([imported - start, constructed - imported, fetched - constructed]))
+'''
+
+def bench_startup(server, options, runs=10):
+    """
+    What a short-lived process pays before its first result: importing the
+    module, constructing a client and making the first fetch, each measured
+    in a fresh interpreter, plus the whole process
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    for i in range(runs):
+        start = time.time()
+        output = subprocess.check_output([sys.executable, '-c', STARTUP, server.base_uri], cwd=here)
+        timings.append(json.loads(output.decode('ascii').strip()) + [time.time() - start])
+    best = [min(column) for column in zip(*timings)]
+    return {
+        'import_ms': best[0] * 1e3,
+        'construct_us': best[1] * 1e6,
+        'first_fetch_ms': best[2] * 1e3,
+        'process_ms': best[3] * 1e3,
+    }
+
+BENCHMARKS = {
+    'cache': bench_cache,
+    'decode': bench_decode,
+    'memory': bench_memory,
+    'overhead': bench_overhead,
+    'pagination': bench_pagination,
+    'startup': bench_startup,
+}
+
+def environment():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)),
+                                         stderr=subprocess.STDOUT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+def higher_is_better(metric):
+    return metric.endswith('_per_s')
+
+def compare(before, after, threshold=5.0):
+    "Prints every metric of two result files side by side"
+    print("%-34s %12s %12s %8s" % ('', before['environment']['commit'] or 'before',
+                                   after['environment']['commit'] or 'after', 'change'))
+    for name in sorted(set(before['results']) | set(after['results'])):
+        old = before['results'].get(name, {})
+        new = after['results'].get(name, {})
+        for metric in sorted(set(old) | set(new)):
+            if metric not in old or metric not in new:
+                print("%-34s %12s %12s" % ('%s.%s' % (name, metric),
+                                           '%.1f' % old[metric] if metric in old else '-',
+                                           '%.1f' % new[metric] if metric in new else '-'))
+                continue
+            change = (new[metric] - old[metric]) / old[metric] * 100 if old[metric] else 0
+            better = change > 0 if higher_is_better(metric) else change < 0
+            flag = '' if abs(change) < threshold else (' better' if better else ' worse')
+            print("%-34s %12.1f %12.1f %+7.1f%%%s" % ('%s.%s' % (name, metric), old[metric],
+                                                       new[metric], change, flag))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks for nytcampfin")
+    parser.add_argument('names', nargs='*', help="benchmarks to run: %s" % ', '.join(sorted(BENCHMARKS)))
+    parser.add_argument('--delay', type=float, default=0.002,
+                        help="simulated network latency per request, in seconds")
+    parser.add_argument('--jitter', type=float, default=0,
+                        help="up to this many more seconds per request, at random")
+    parser.add_argument('--padding', type=int, default=0,
+                        help="extra bytes per stub record, for heavier payloads")
+    parser.add_argument('--pages', type=int, default=50,
+                        help="pages in the paged endpoint")
+    parser.add_argument('--json', metavar='PATH', help="write results here")
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help="compare two result files instead of running")
+    options = parser.parse_args(argv)
+
+    if options.compare:
+        with open(options.compare[0]) as before, open(options.compare[1]) as after:
+            compare(json.load(before), json.load(after))
+        return
+
+    server = StubServer(total=options.pages * nytcampfin.PAGE_SIZE, delay=options.delay,
+                        jitter=options.jitter, padding=options.padding).start()
+    results = {}
+    try:
+        for name in options.names or sorted(BENCHMARKS):
+            results[name] = BENCHMARKS[name](server, options)
+            for metric, value in sorted(results[name].items()):
+                print("%-34s %12.1f" % ('%s.%s' % (name, metric), value))
+    finally:
+        server.stop()
+
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump({
+                'environment': environment(),
+                'options': dict((k, getattr(options, k)) for k in
+                                ('delay', 'jitter', 'padding', 'pages')),
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
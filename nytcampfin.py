@@ -4,17 +4,98 @@ A Python client for the New York Times Campaign Finance API
 __author__ = "Derek Willis (dwillis@nytimes.com)"
 __version__ = "0.4.0"
 
+import io
 import os
-import requests
-import requests_cache
+import re
+import sys
+import math
+import json
+import time
+import random
+import datetime
+import hashlib
+import threading
+from array import array
+from collections import deque, namedtuple, OrderedDict
 
-__all__ = ('NytCampfin', 'NytCampfinError', 'NytNotFoundError')
+try:
+    from urllib.parse import urlencode, parse_qsl
+except ImportError:
+    from urllib import urlencode
+    from urlparse import parse_qsl
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+# requests, numpy, sqlite3, multiprocessing, csv and gzip are imported
+# where they are first needed, so that importing this module stays cheap
+# for short-lived processes that use only part of it
+
+__all__ = ('NytCampfin', 'NytCampfinError', 'NytNotFoundError', 'Transport',
+           'FixtureTransport',
+           'Cache', 'MemoryCache', 'SqliteCache', 'DirectoryCache',
+           'Validators', 'Watcher', 'RateLimiter', 'SingleFlight',
+           'BatchResult', 'loads', 'lazy_loads', 'Record', 'Filing',
+           'IndependentExpenditure', 'LateContribution', 'Columns', 'Mirror',
+           'RequestEvent', 'Metrics', 'export', 'Crawl', 'CrawlUnit',
+           'date_units', 'committee_units', 'WarmStart')
 
 DEBUG = False
 
 CURRENT_CYCLE = 2012
 
-requests_cache.configure(expire_after=5)
+# Number of results the API returns per page; a shorter page is the last one
+PAGE_SIZE = 20
+
+# Default ceiling on concurrent requests made by a single bulk call
+CONCURRENCY = 4
+
+# Seconds to cache a response, by path template; anything not listed
+# here is cached for DEFAULT_TTL
+DEFAULT_TTL = 5 * 60
+
+TTLS = {
+    "/%s/filings": 10,
+    "/%s/filings/amendments": 60,
+    "/%s/filings/types": 24 * 60 * 60,
+    "/%s/independent_expenditures": 10,
+    "/%s/contributions/48hour": 10,
+    "/%s/candidates/new": 60,
+    "/%s/committees/new": 60,
+    "/%s/committees/leadership": 24 * 60 * 60,
+    "/%s/committees/superpacs": 60 * 60,
+    "/%s/president/totals": 60 * 60,
+}
+
+# Endpoints for past cycles hardly change, so they are kept this long...
+CLOSED_CYCLE_TTL = 30 * 24 * 60 * 60
+
+# ...except for these feeds of newly received records
+LIVE_ENDPOINTS = frozenset([
+    "/%s/filings",
+    "/%s/filings/amendments",
+    "/%s/independent_expenditures",
+    "/%s/contributions/48hour",
+    "/%s/candidates/new",
+    "/%s/committees/new",
+])
 
 # Error classes
 
@@ -28,17 +109,1317 @@ class NytNotFoundError(NytCampfinError):
     Exception for things not found
     """
 
+# Rate limiting
+
+class RateLimiter(object):
+    """
+    A token bucket allowing rate requests per second, in bursts of up to
+    burst requests
+
+    One limiter can be shared by any number of threads. Give it a path and
+    the bucket is kept in that file instead, locked on every request, so
+    all processes on the host using the same path share a single budget.
+    """
+
+    def __init__(self, rate=5, burst=None, path=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        self.path = path
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        "Blocks until a request may be made"
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def try_acquire(self):
+        "Takes a token if one is free; otherwise returns the seconds to wait"
+        with self._lock:
+            if self.path and fcntl:
+                return self._take_shared()
+            self._tokens, self._updated, wait = self._take(self._tokens, self._updated)
+            return wait
+
+    def available(self):
+        "Returns the number of requests that could be made right now"
+        with self._lock:
+            tokens, updated = self._tokens, self._updated
+            if self.path and fcntl and os.path.exists(self.path):
+                with open(self.path) as f:
+                    tokens, updated = self._parse(f.read())
+        return min(self.burst, tokens + (time.time() - updated) * self.rate)
+
+    def _take(self, tokens, updated):
+        now = time.time()
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            return tokens - 1, now, 0
+        return tokens, now, (1 - tokens) / self.rate
+
+    def _parse(self, state):
+        try:
+            tokens, updated = state.split()
+            return float(tokens), float(updated)
+        except ValueError:
+            return self.burst, time.time()
+
+    def _take_shared(self):
+        # opened per call: a descriptor inherited across fork would share
+        # its lock with the parent
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            state = os.read(fd, 64).decode('ascii')
+            tokens, updated, wait = self._take(*self._parse(state))
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, ('%r %r' % (tokens, updated)).encode('ascii'))
+            return wait
+        finally:
+            os.close(fd)
+
+# Mashery error codes the API sends with a 403 when a key is over its
+# per-second limit; going over the daily limit is not worth retrying
+THROTTLE_ERRORS = ('ERR_403_DEVELOPER_OVER_QPS',)
+
+def _throttled(status_code, headers):
+    "Whether a response is worth retrying after a pause"
+    if status_code == 429 or status_code >= 500:
+        return True
+    return (status_code == 403 and
+            headers.get('X-Mashery-Error-Code') in THROTTLE_ERRORS)
+
+def _backoff(attempt, headers, base, cap):
+    """
+    Seconds to wait before a retry: full-jitter exponential backoff, or the
+    server's Retry-After if longer. None when Retry-After is over the cap,
+    as the response is better handed back than slept on.
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    try:
+        retry_after = float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return delay
+    return max(delay, retry_after) if retry_after <= cap else None
+
+def _quota(headers):
+    """
+    Parses X-RateLimit-Limit-<period> and X-RateLimit-Remaining-<period>
+    headers into {period: {'limit': n, 'remaining': n}}
+    """
+    quota = {}
+    for name, value in headers.items():
+        parts = name.lower().split('-')
+        if len(parts) == 4 and parts[:2] == ['x', 'ratelimit'] and parts[2] in ('limit', 'remaining'):
+            try:
+                quota.setdefault(parts[3], {})[parts[2]] = int(value)
+            except ValueError:
+                pass
+    return quota
+
+# JSON decoding
+
+def _json_loads(body):
+    return json.loads(body.decode('utf-8'))
+
+# the fastest installed decoder; all of them take the raw response bytes
+if orjson is not None:
+    loads = orjson.loads
+elif ujson is not None:
+    loads = ujson.loads
+else:
+    loads = _json_loads
+
+_RESULTS_ARRAY = re.compile(br'"results"\s*:\s*\[\s*')
+_BETWEEN_RECORDS = re.compile(br'\}\s*,\s*\{')
+_LAST_RECORD = re.compile(br'\}\s*\]')
+
+def _results_spans(body):
+    """
+    Splits the results array of a response body into records without
+    parsing them. Returns the array's (start, end) and the (start, end) of
+    each record, or None if the array is empty or not a list of objects.
+
+    The split is only a guess -- "}, {" can also appear inside a record --
+    so lazy_loads checks the number of records against num_results.
+    """
+    array = _RESULTS_ARRAY.search(body)
+    if array is None or body[array.end():array.end() + 1] != b'{':
+        return None
+    last = _LAST_RECORD.search(body, array.end())
+    if last is None:
+        return None
+    records = []
+    start = array.end()
+    for between in _BETWEEN_RECORDS.finditer(body, start, last.start()):
+        records.append((start, between.start() + 1))
+        start = between.end() - 1
+    records.append((start, last.start() + 1))
+    return (array.start() + len(b'"results"'), last.end()), records
+
+class LazyRecords(object):
+    """
+    A read-only list of records that are only decoded when accessed
+
+    Returned in place of a response's results by lazy_loads. Each record is
+    decoded on first access and kept.
+    """
+
+    def __init__(self, body, spans, loads=loads):
+        self._body = body
+        self._spans = spans
+        self._loads = loads
+        self._records = [None] * len(spans)
+
+    def __len__(self):
+        return len(self._spans)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        record = self._records[index]
+        if record is None:
+            start, end = self._spans[index]
+            record = self._records[index] = self._loads(self._body[start:end])
+        return record
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __eq__(self, other):
+        if not isinstance(other, (list, tuple, LazyRecords)):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __repr__(self):
+        return '<LazyRecords: %s records>' % len(self)
+
+def lazy_loads(body, loads=loads):
+    """
+    Decodes a response body, except for the records in its results, which
+    are left as LazyRecords; pass it as a client's decoder. Responses that
+    are not a list of objects, or that can't be split safely, are decoded
+    in full.
+    """
+    spans = _results_spans(body)
+    if spans is not None:
+        (start, end), records = spans
+        try:
+            result = loads(body[:start] + b': []' + body[end:])
+        except ValueError:
+            result = None
+        if (isinstance(result, dict) and result.get('results') == [] and
+                result.get('num_results') == len(records)):
+            result['results'] = LazyRecords(body, records, loads)
+            return result
+    return loads(body)
+
+# Transport
+
+class Transport(object):
+    """
+    A pooled, keep-alive HTTP transport
+
+    One Transport is shared by a NytCampfin instance and all of its
+    sub-clients, so repeated lookups reuse open connections instead of
+    paying for a new handshake every time.
+
+    pool_connections is the number of host pools to keep, pool_maxsize the
+    number of connections kept open per host, max_retries (connection
+    errors only) is handed to requests' HTTPAdapter as an int or a urllib3
+    Retry, and timeout applies to every request, in seconds.
+
+    Every request first waits on limiter, a RateLimiter, if given.
+    Throttled (429, or 403 over the per-second limit) and 5xx responses
+    are retried up to retries times, after a jittered exponential pause
+    starting at backoff seconds and capped at max_backoff, or after the
+    Retry-After the response asks for. A response asking for longer than
+    max_backoff is returned as it is, without retrying. The quota the
+    API reports back is kept in the quota attribute.
+
+    The requests session is set up on first use.
+    """
+
+    def __init__(self, pool_connections=4, pool_maxsize=10, max_retries=0,
+                 timeout=30, pool_block=False, limiter=None, retries=3,
+                 backoff=0.5, max_backoff=30):
+        self.timeout = timeout
+        self.limiter = limiter
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.quota = {}
+        self.requests = 0
+        self.retried = 0
+        self._pool = {'pool_connections': pool_connections,
+                      'pool_maxsize': pool_maxsize,
+                      'max_retries': max_retries,
+                      'pool_block': pool_block}
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            with self._lock:
+                if self._session is None:
+                    self.adapter = HTTPAdapter(**self._pool)
+                    session = requests.Session()
+                    session.mount('http://', self.adapter)
+                    session.mount('https://', self.adapter)
+                    self._session = session
+        return self._session
+
+    def get(self, url, params=None, headers=None):
+        attempt = 0
+        while True:
+            if self.limiter:
+                self.limiter.acquire()
+            with self._lock:
+                self.requests += 1
+            resp = self.session.get(url, params=params, headers=headers,
+                                    timeout=self.timeout)
+            self.quota.update(_quota(resp.headers))
+            wait = None
+            if attempt < self.retries and _throttled(resp.status_code, resp.headers):
+                wait = _backoff(attempt, resp.headers, self.backoff, self.max_backoff)
+            if wait is None:
+                resp.retries = attempt
+                return resp
+            time.sleep(wait)
+            attempt += 1
+            with self._lock:
+                self.retried += 1
+
+    @property
+    def connections(self):
+        "Number of connections opened so far, across all host pools"
+        if self._session is None:
+            return 0
+        pools = self.adapter.poolmanager.pools
+        total = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                total += pool.num_connections
+        return total
+
+    def stats(self):
+        "Returns request and connection counters for this transport"
+        requests_made = self.requests
+        connections = self.connections
+        return {
+            'requests': requests_made,
+            'connections': connections,
+            'reused': max(requests_made - connections, 0),
+            'retried': self.retried,
+        }
+
+    def headroom(self):
+        """
+        Returns the requests left under each limit: the API's own per-period
+        quota, as last reported, and the local limiter's free tokens
+        """
+        headroom = dict((period, counts['remaining'])
+                        for period, counts in self.quota.items()
+                        if 'remaining' in counts)
+        if self.limiter:
+            headroom['limiter'] = self.limiter.available()
+        return headroom
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+def _request_key(url, params=None):
+    "Identifies a request by its url and params, leaving out the API key"
+    url, _, query = url.partition('?')
+    params = parse_qsl(query) + list((params or {}).items())
+    params = sorted((k, v) for k, v in params if k != 'api-key')
+    return url + '?' + urlencode(params)
+
+# What a FixtureTransport hands back in place of a requests Response
+FixtureResponse = namedtuple('FixtureResponse', 'status_code content headers')
+
+class FixtureTransport(object):
+    """
+    Records responses to a directory of JSON fixtures, or replays them
+    without touching the network
+
+        >>> finance = NytCampfin(apikey, transport=FixtureTransport('fixtures', 'record'))
+        >>> offline = NytCampfin('any-key', transport=FixtureTransport('fixtures'))
+
+    In 'record' mode every request goes through transport (a new Transport
+    by default) and its response is saved; in 'replay' mode responses come
+    only from the fixtures, and a request without one raises
+    NytCampfinError. 'once' replays what it has and records the rest.
+
+    Fixtures are keyed like the cache, by url and params without the API
+    key, so they can be recorded with a real key and shared freely.
+    Conditional headers are dropped when recording, so every fixture is a
+    complete response.
+    """
+
+    def __init__(self, path='fixtures', mode='replay', transport=None):
+        if mode not in ('record', 'replay', 'once'):
+            raise ValueError("mode must be 'record', 'replay' or 'once'")
+        self.path = path
+        self.mode = mode
+        self._transport = transport
+        self.quota = {}
+        self.requests = 0
+        self.recorded = 0
+        self.replayed = 0
+        self._lock = threading.Lock()
+
+    @property
+    def transport(self):
+        if self._transport is None:
+            self._transport = Transport()
+        return self._transport
+
+    def _filename(self, url, params):
+        name = hashlib.sha1(_request_key(url, params).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, name + '.json')
+
+    def get(self, url, params=None, headers=None):
+        filename = self._filename(url, params)
+        with self._lock:
+            self.requests += 1
+        if self.mode == 'replay' or (self.mode == 'once' and os.path.exists(filename)):
+            return self._replay(url, params, filename)
+        return self._record(url, params, filename)
+
+    def _replay(self, url, params, filename):
+        try:
+            with open(filename, 'rb') as f:
+                fixture = json.loads(f.read().decode('utf-8'))
+        except IOError:
+            raise NytCampfinError("No fixture recorded for %s" % _request_key(url, params))
+        with self._lock:
+            self.replayed += 1
+        return FixtureResponse(fixture['status'], fixture['body'].encode('utf-8'),
+                               fixture['headers'])
+
+    def _record(self, url, params, filename):
+        resp = self.transport.get(url, params=params)
+        self.quota = self.transport.quota
+        fixture = {
+            'request': _request_key(url, params),
+            'status': resp.status_code,
+            'headers': dict(resp.headers),
+            'body': resp.content.decode('utf-8', 'replace'),
+        }
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        tmp = '%s.%s.tmp' % (filename, threading.current_thread().ident)
+        with open(tmp, 'wb') as f:
+            f.write(json.dumps(fixture, indent=2, sort_keys=True).encode('utf-8'))
+        _replace(tmp, filename)
+        with self._lock:
+            self.recorded += 1
+        return FixtureResponse(resp.status_code, resp.content, resp.headers)
+
+    def stats(self):
+        return {'requests': self.requests, 'recorded': self.recorded,
+                'replayed': self.replayed}
+
+    def headroom(self):
+        return {}
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+
+class _Prefetch(threading.Thread):
+    """
+    Fetches a single page in a background thread
+    """
+
+    def __init__(self, func, *args):
+        super(_Prefetch, self).__init__()
+        self.daemon = True
+        self.func = func
+        self.args = args
+        self.value = None
+        self.error = None
+        self.start()
+
+    def run(self):
+        try:
+            self.value = self.func(*self.args)
+        except Exception as e:
+            self.error = e
+
+    def result(self):
+        self.join()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+# Caches
+
+class Cache(object):
+    """
+    Base class for response caches
+
+    Caches store raw response bodies keyed by request URL, each with its
+    own expiry time, and count hits, misses and evictions (entries dropped
+    because they expired or to make room). Backends implement _get, _set
+    and _delete.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        "Returns the cached body for key, or None if missing or expired"
+        entry = self._get(key)
+        if entry is not None and entry[1] <= time.time():
+            self._delete(key)
+            self._count('evictions')
+            entry = None
+        if entry is None:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return entry[0]
+
+    def __contains__(self, key):
+        "Whether key is cached and fresh; doesn't count as a hit or miss"
+        return self.entry(key) is not None
+
+    def entry(self, key):
+        """
+        Returns (body, expires) for key if it is cached and fresh, else
+        None; doesn't count as a hit or miss
+        """
+        entry = self._get(key)
+        if entry is not None and entry[1] > time.time():
+            return entry
+
+    def set(self, key, body, ttl):
+        "Caches body for ttl seconds"
+        if ttl > 0:
+            self._set(key, body, time.time() + ttl)
+
+    def stats(self):
+        "Returns hit, miss and eviction counters for this cache"
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+    def _count(self, counter, n=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+class MemoryCache(Cache):
+    """
+    An in-process LRU cache holding at most max_bytes of response bodies
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        super(MemoryCache, self).__init__()
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+            return entry
+
+    def _set(self, key, body, expires):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self._entries[key] = (body, expires)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                evicted, entry = self._entries.popitem(last=False)
+                self.size -= len(entry[0])
+                self.evictions += 1
+
+    def _delete(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= len(entry[0])
+
+    def purge(self):
+        "Deletes every expired entry"
+        now = time.time()
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry[1] <= now:
+                    del self._entries[key]
+                    self.size -= len(entry[0])
+                    self.evictions += 1
+
+class SqliteCache(Cache):
+    """
+    A cache kept in a sqlite database, cache.sqlite by default, that
+    survives restarts and can be shared by processes on one host
+    """
+
+    def __init__(self, path='cache.sqlite'):
+        super(SqliteCache, self).__init__()
+        self.path = path
+        self._db = None
+
+    @property
+    def db(self):
+        if self._db is None:
+            import sqlite3
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS cache "
+                             "(key TEXT PRIMARY KEY, body BLOB, expires REAL)")
+            self._db.commit()
+        return self._db
+
+    def _get(self, key):
+        with self._lock:
+            row = self.db.execute("SELECT body, expires FROM cache WHERE key = ?",
+                                  (key,)).fetchone()
+        if row is not None:
+            return bytes(row[0]), row[1]
+
+    def _set(self, key, body, expires):
+        import sqlite3
+        with self._lock:
+            self.db.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)",
+                            (key, sqlite3.Binary(body), expires))
+            self.db.commit()
+
+    def _delete(self, key):
+        with self._lock:
+            self.db.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self.db.commit()
+
+    def entries(self, urls=None):
+        """
+        Returns every (key, body, expires) entry, fresh or not, in one read;
+        only those for the given request urls, if any
+        """
+        sql, params = "SELECT key, body, expires FROM cache", []
+        if urls:
+            # keys are url + '?' + params, and '@' sorts right after '?'
+            sql += " WHERE " + " OR ".join(["(key >= ? AND key < ?)"] * len(urls))
+            for url in urls:
+                params.extend((url + '?', url + '@'))
+        with self._lock:
+            rows = self.db.execute(sql, params).fetchall()
+        return [(key, bytes(body), expires) for key, body, expires in rows]
+
+    def purge(self):
+        "Deletes every expired entry"
+        with self._lock:
+            count = self.db.execute("DELETE FROM cache WHERE expires <= ?",
+                                    (time.time(),)).rowcount
+            self.db.commit()
+            self.evictions += count
+
+class DirectoryCache(Cache):
+    """
+    A cache that keeps one file per response in a directory
+    """
+
+    def __init__(self, path='cache'):
+        super(DirectoryCache, self).__init__()
+        self.path = path
+
+    def _filename(self, key):
+        return os.path.join(self.path, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def _get(self, key):
+        try:
+            with open(self._filename(key), 'rb') as f:
+                expires = float(f.readline())
+                return f.read(), expires
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _set(self, key, body, expires):
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                pass
+        filename = self._filename(key)
+        tmp = '%s.%s.%s' % (filename, os.getpid(), threading.current_thread().ident)
+        with open(tmp, 'wb') as f:
+            f.write(('%r\n' % expires).encode('ascii'))
+            f.write(body)
+        _replace(tmp, filename)
+
+    def _delete(self, key):
+        try:
+            os.remove(self._filename(key))
+        except OSError:
+            pass
+
+    def purge(self):
+        "Deletes every expired entry"
+        if not os.path.isdir(self.path):
+            return
+        for name in os.listdir(self.path):
+            filename = os.path.join(self.path, name)
+            try:
+                with open(filename, 'rb') as f:
+                    expired = float(f.readline()) <= time.time()
+            except (IOError, OSError, ValueError):
+                continue
+            if expired:
+                try:
+                    os.remove(filename)
+                except OSError:
+                    continue
+                self._count('evictions')
+
+_Validator = namedtuple('_Validator', 'etag last_modified body result')
+
+class Validators(object):
+    """
+    Remembers the ETag and Last-Modified headers of the most recent
+    max_entries responses, along with their bodies and decoded results
+
+    Refetches of those URLs are sent as conditional requests, and a 304 Not
+    Modified is answered with the stored result, skipping both the download
+    and the JSON decoding. Counters report how much that saved.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.revalidated = 0
+        self.bytes_saved = 0
+        self.parses_saved = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def headers(self, key):
+        "Returns the conditional request headers for key, if any"
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        headers = {}
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    def set(self, key, headers, body, result):
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if not (etag or last_modified):
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = _Validator(etag, last_modified, body, result)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def not_modified(self, key):
+        "Returns the stored entry for key after a 304, counting the savings"
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+                self.revalidated += 1
+                self.bytes_saved += len(entry.body)
+                self.parses_saved += 1
+            return entry
+
+    def stats(self):
+        "Returns revalidation counters"
+        return {'revalidated': self.revalidated, 'bytes_saved': self.bytes_saved,
+                'parses_saved': self.parses_saved}
+
+class _Evicted(Exception):
+    "A 304 arrived after the response it refers to dropped out of Validators"
+
+# Request coalescing
+
+class _Call(object):
+    "A request in flight, shared by everyone waiting on it"
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight(object):
+    """
+    Collapses concurrent identical calls into one
+
+    While a call for a key is in flight, other threads asking for the same
+    key wait for it and share its result, or its error, instead of making
+    their own. coalesced counts the calls that were spared.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func(*args)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+def _replace(src, dst):
+    "Atomically renames src over dst"
+    getattr(os, 'replace', os.rename)(src, dst)
+
+class BatchResult(dict):
+    """
+    Records from a batch lookup keyed by ID, with the NytNotFoundError for
+    each ID that could not be found kept in errors
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(BatchResult, self).__init__(*args, **kwargs)
+        self.errors = {}
+
+# Records
+
+def _to_int(value):
+    return int(value) if value not in (None, '') else None
+
+def _to_float(value):
+    return float(value) if value not in (None, '') else None
+
+def _to_date(value):
+    if not value:
+        return None
+    # only plain dates; a timestamp would lose its time of day
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+def _from_date(value):
+    return value.isoformat() if value is not None else None
+
+INT = (_to_int, None)
+FLOAT = (_to_float, None)
+DATE = (_to_date, _from_date)
+
+class Record(object):
+    """
+    Base class for compact, typed result records
+
+    Subclasses list their fields in FIELDS, as (name, kind) pairs where kind
+    is None for values kept as they are, or one of INT, FLOAT and DATE.
+    Values are converted once, when the record is built; any value that
+    doesn't convert is kept as it came. Fields a record doesn't declare end
+    up in _extra, so to_dict gives back every field, with dates as ISO
+    strings and declared fields that were missing as None.
+
+    Records can also be read like the dicts they replace.
+    """
+    __slots__ = ('_extra',)
+    FIELDS = ()
+
+    @classmethod
+    def from_dict(cls, data):
+        record = cls.__new__(cls)
+        for name, kind in cls.FIELDS:
+            value = data.get(name)
+            if kind is not None:
+                try:
+                    value = kind[0](value)
+                except (TypeError, ValueError):
+                    pass
+            setattr(record, name, value)
+        # built fresh rather than popped from a copy, which would keep the
+        # copy's full-size hash table
+        extra = dict((key, value) for key, value in data.items()
+                     if key not in cls.__slots__)
+        record._extra = extra or None
+        return record
+
+    def to_dict(self):
+        data = {}
+        for name, kind in self.FIELDS:
+            value = getattr(self, name)
+            if kind is not None and kind[1] is not None and not isinstance(value, string_types):
+                value = kind[1](value)
+            data[name] = value
+        if self._extra:
+            data.update(self._extra)
+        return data
+
+    def __getitem__(self, name):
+        if name in self.__slots__:
+            return getattr(self, name)
+        if self._extra and name in self._extra:
+            return self._extra[name]
+        raise KeyError(name)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<%s: %s>' % (type(self).__name__, getattr(self, self.FIELDS[0][0]))
+
+def _record_type(name, fields):
+    "Builds a Record subclass with a slot for each of fields"
+    return type(name, (Record,), {
+        '__slots__': tuple(field for field, kind in fields),
+        'FIELDS': tuple(fields),
+    })
+
+Filing = _record_type('Filing', [
+    ('filing_id', INT),
+    ('committee', None),
+    ('committee_name', None),
+    ('candidate', None),
+    ('form_type', None),
+    ('report_title', None),
+    ('date_filed', DATE),
+    ('date_coverage_from', DATE),
+    ('date_coverage_to', DATE),
+    ('receipts_total', FLOAT),
+    ('contributions_total', FLOAT),
+    ('disbursements_total', FLOAT),
+    ('cash_on_hand', FLOAT),
+    ('is_amendment', None),
+    ('original_filing', INT),
+    ('fec_uri', None),
+])
+
+IndependentExpenditure = _record_type('IndependentExpenditure', [
+    ('fec_filing_id', INT),
+    ('transaction_id', None),
+    ('fec_committee_id', None),
+    ('committee', None),
+    ('committee_name', None),
+    ('fec_candidate_id', None),
+    ('candidate', None),
+    ('candidate_name', None),
+    ('office', None),
+    ('state', None),
+    ('district', None),
+    ('support_or_oppose', None),
+    ('amount', FLOAT),
+    ('date', DATE),
+    ('date_received', DATE),
+    ('purpose', None),
+    ('payee', None),
+    ('amendment', None),
+])
+
+LateContribution = _record_type('LateContribution', [
+    ('fec_filing_id', INT),
+    ('transaction_id', None),
+    ('fec_committee_id', None),
+    ('committee_name', None),
+    ('fec_candidate_id', None),
+    ('candidate_name', None),
+    ('contributor_name', None),
+    ('contributor_city', None),
+    ('contributor_state', None),
+    ('contributor_zip', None),
+    ('contributor_employer', None),
+    ('contributor_occupation', None),
+    ('contribution_amount', FLOAT),
+    ('contribution_date', DATE),
+])
+
+# Record class for each list endpoint, by path template, used when a client
+# is created with typed=True
+RECORD_TYPES = {
+    "/%s/filings": Filing,
+    "/%s/filings/%s/%s/%s": Filing,
+    "/%s/filings/types/%s": Filing,
+    "/%s/filings/amendments": Filing,
+    "/%s/committees/%s/filings": Filing,
+    "/%s/independent_expenditures": IndependentExpenditure,
+    "/%s/independent_expenditures/%s/%s/%s": IndependentExpenditure,
+    "/%s/committees/%s/independent_expenditures": IndependentExpenditure,
+    "/%s/candidates/%s/independent_expenditures": IndependentExpenditure,
+    "/%s/president/independent_expenditures": IndependentExpenditure,
+    "/%s/contributions/48hour": LateContribution,
+    "/%s/contributions/48hour/%s/%s/%s": LateContribution,
+    "/%s/candidates/%s/48hour": LateContribution,
+    "/%s/committees/%s/48hour": LateContribution,
+}
+
+# Columns
+
+# numpy, once Columns first needs it: False until then, None if not installed
+numpy = False
+
+def _number(value):
+    "value as a float, or NaN when it is missing or not a number"
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+def _numpy():
+    global numpy
+    if numpy is False:
+        try:
+            import numpy as module
+        except ImportError:
+            module = None
+        numpy = module
+    return numpy
+
+class Columns(object):
+    """
+    Records stored column by column, for aggregating without per-row dicts
+
+    Build one from any iterable of records, such as a paginate() stream;
+    only the current page is held as dicts. numeric columns are packed into
+    arrays of doubles as they arrive, with missing values as NaN; the rest
+    are kept as lists. Reading a column gives a NumPy array when NumPy is
+    installed, or the array or list itself otherwise.
+
+        >>> cols = finance.to_columns(finance.indexp.candidate, 'P80003353',
+        ...                           numeric=['amount'])
+        >>> cols.totals_by_support_oppose()
+        {'S': 1234.0, 'O': 567.0}
+
+    fields defaults to every field of the first record, and numeric to the
+    fields whose first value is a number. The totals_by helpers read their
+    value column as numbers either way.
+    """
+
+    def __init__(self, fields=None, numeric=None):
+        self.fields = list(fields) if fields is not None else None
+        self.numeric = set(numeric) if numeric is not None else None
+        self.length = 0
+        self._buffers = {}
+
+    def _start(self, record):
+        first = record if isinstance(record, dict) else record.to_dict()
+        if self.fields is None:
+            self.fields = sorted(first.keys())
+        if self.numeric is None:
+            self.numeric = set(name for name in self.fields
+                               if isinstance(first.get(name), (int, float)) and
+                               not isinstance(first.get(name), bool))
+        for name in self.fields:
+            self._buffers[name] = array('d') if name in self.numeric else []
+
+    def extend(self, records):
+        "Appends records, consuming the iterable as it goes"
+        for record in records:
+            if not self._buffers:
+                self._start(record)
+            for name, buf in self._buffers.items():
+                value = record.get(name)
+                buf.append(_number(value) if name in self.numeric else value)
+            self.length += 1
+        return self
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, name):
+        buf = self._buffers[name]
+        if _numpy() is None:
+            return buf
+        if name in self.numeric:
+            return numpy.array(buf, dtype=numpy.float64)
+        return numpy.array(buf, dtype=object)
+
+    def totals_by(self, key, value='amount'):
+        "Sums the value column for each distinct value of the key column"
+        if not self.length:
+            return {}
+        amounts = self._buffers[value]
+        if value not in self.numeric:
+            # its first value wasn't a number, such as '50'
+            amounts = array('d', [_number(amount) for amount in amounts])
+        if _numpy() is None:
+            totals = {}
+            for group, amount in zip(self._buffers[key], amounts):
+                if amount == amount: # not NaN
+                    totals[group] = totals.get(group, 0.0) + amount
+            return totals
+        amounts = numpy.array(amounts, dtype=numpy.float64)
+        keep = ~numpy.isnan(amounts)
+        try:
+            groups, codes = numpy.unique(self[key][keep], return_inverse=True)
+        except TypeError:
+            # mixed types, such as None among strings, don't sort
+            index = {}
+            codes = numpy.array([index.setdefault(group, len(index))
+                                 for group in self[key][keep]], dtype=numpy.intp)
+            groups = sorted(index, key=index.get)
+        sums = numpy.bincount(codes, weights=amounts[keep], minlength=len(groups))
+        return dict(zip(groups, sums.tolist()))
+
+    def totals_by_candidate(self, key='fec_candidate_id', value='amount'):
+        return self.totals_by(key, value)
+
+    def totals_by_date(self, key='date', value='amount'):
+        return self.totals_by(key, value)
+
+    def totals_by_support_oppose(self, key='support_or_oppose', value='amount'):
+        return self.totals_by(key, value)
+
+# Instrumentation
+
+# The most precise clock available, for timing requests
+_clock = getattr(time, 'perf_counter', time.time)
+
+class RequestEvent(object):
+    """
+    What a client's hooks learn about a single fetch
+
+    endpoint is the path template, shared by every call to the same method.
+    cache is 'hit', 'miss', 'revalidated' (a 304 reused the cached result)
+    or 'coalesced' (another thread's identical request answered this one).
+    network, decode, parse and elapsed are in seconds; network and decode
+    are None when the phase didn't happen. bytes is the size of the body
+    that was decoded or reused, and retries the number of throttled
+    attempts the transport retried. error is set when the fetch raised.
+    """
+
+    def __init__(self, endpoint, url, args):
+        self.endpoint = endpoint
+        self.url = url
+        self.args = args
+        self.cache = None
+        self.status = None
+        self.bytes = 0
+        self.retries = 0
+        self.network = None
+        self.decode = None
+        self.parse = None
+        self.elapsed = None
+        self.error = None
+
+    def __repr__(self):
+        return '<RequestEvent %s %s %s %.1fms>' % (self.endpoint, self.args, self.cache,
+                                                  (self.elapsed or 0) * 1000)
+
+def _percentile(ordered, percent):
+    "Nearest-rank percentile of an already sorted list"
+    if not ordered:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(ordered)))
+    return ordered[max(rank - 1, 0)]
+
+class Metrics(object):
+    """
+    A hook that aggregates request timings in process, per endpoint
+
+        >>> metrics = Metrics()
+        >>> finance = NytCampfin(apikey, hooks=[metrics])
+        >>> finance.filings.today()
+        >>> metrics.report()['/%s/filings']['p95']
+
+    Percentiles are taken over the last `window` requests to each
+    endpoint; counts and totals cover every request since the last reset.
+    """
+
+    def __init__(self, window=10000):
+        self.window = window
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def after_request(self, event):
+        with self._lock:
+            stats = self._endpoints.get(event.endpoint)
+            if stats is None:
+                stats = self._endpoints[event.endpoint] = {
+                    'samples': deque(maxlen=self.window), 'calls': 0, 'errors': 0,
+                    'bytes': 0, 'retries': 0, 'network': 0.0, 'decode': 0.0,
+                    'parse': 0.0, 'cache': {},
+                }
+            stats['samples'].append(event.elapsed)
+            stats['calls'] += 1
+            stats['errors'] += event.error is not None
+            stats['bytes'] += event.bytes
+            stats['retries'] += event.retries
+            for phase in ('network', 'decode', 'parse'):
+                stats[phase] += getattr(event, phase) or 0
+            stats['cache'][event.cache] = stats['cache'].get(event.cache, 0) + 1
+
+    def report(self):
+        """
+        Returns, for each endpoint, p50/p95/p99 and mean latency and the
+        seconds spent in each phase, in seconds, with call, error, byte,
+        retry and cache status counts
+        """
+        with self._lock:
+            endpoints = [(endpoint, dict(stats, samples=sorted(stats['samples']),
+                                         cache=dict(stats['cache'])))
+                         for endpoint, stats in self._endpoints.items()]
+        report = {}
+        for endpoint, stats in endpoints:
+            samples = stats.pop('samples')
+            stats.update(
+                p50=_percentile(samples, 50),
+                p95=_percentile(samples, 95),
+                p99=_percentile(samples, 99),
+                mean=sum(samples) / len(samples),
+            )
+            report[endpoint] = stats
+        return report
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
 # Clients
 
+def _thread_pool(size):
+    from multiprocessing.pool import ThreadPool
+    return ThreadPool(size)
+
 class Client(object):
         
     BASE_URI = "http://api.nytimes.com/svc/elections/us/v3/finances"
     
-    def __init__(self, apikey):
+    def __init__(self, apikey, transport=None, concurrency=CONCURRENCY,
+                 cache=None, ttls=None, validators=None, inflight=None,
+                 decoder=None, typed=False, base_uri=None, hooks=None,
+                 cycle=None):
         self.apikey = apikey
+        if base_uri:
+            self.BASE_URI = base_uri.rstrip('/')
+        self.hooks = [] if hooks is None else hooks
+        self.cycle = cycle or CURRENT_CYCLE
+        self.transport = transport or Transport()
+        self.concurrency = concurrency
+        self.cache = MemoryCache() if cache is None else cache
+        self.ttls = TTLS if ttls is None else ttls
+        self.validators = Validators() if validators is None else validators
+        self.inflight = SingleFlight() if inflight is None else inflight
+        self.decoder = decoder or loads
+        self.typed = typed
     
     def fetch(self, path, *args, **kwargs):
-        if not kwargs['offset']:
+        args = self._with_cycle(args)
+        url, params, parse = self._prepare(path, args, kwargs)
+        key = self._cache_key(url, params)
+        if self.hooks:
+            return self._instrumented_fetch(key, url, params, parse, path, args)
+        body = self.cache.get(key) if self.cache else None
+        if body is None:
+            if self.inflight:
+                result = self.inflight.do(key, self._load, key, url, params, path, args)
+            else:
+                result = self._load(key, url, params, path, args)
+        else:
+            result = self._decode(body)
+        return self._parse(result, parse, url, path)
+
+    def _instrumented_fetch(self, key, url, params, parse, path, args):
+        "fetch, timing each phase for the before_request and after_request hooks"
+        event = RequestEvent(path, url, args)
+        self._call_hooks('before_request', event)
+        start = _clock()
+        try:
+            body = self.cache.get(key) if self.cache else None
+            if body is None:
+                event.cache = 'miss'
+                if self.inflight:
+                    result = self.inflight.do(key, self._load, key, url, params, path, args, event)
+                else:
+                    result = self._load(key, url, params, path, args, event)
+                if event.network is None:
+                    event.cache = 'coalesced'
+            else:
+                event.cache = 'hit'
+                event.bytes = len(body)
+                started = _clock()
+                result = self._decode(body)
+                event.decode = _clock() - started
+            started = _clock()
+            result = self._parse(result, parse, url, path)
+            event.parse = _clock() - started
+            return result
+        except Exception as e:
+            event.error = e
+            raise
+        finally:
+            event.elapsed = _clock() - start
+            self._call_hooks('after_request', event)
+
+    def _call_hooks(self, name, event):
+        for hook in self.hooks:
+            method = getattr(hook, name, None)
+            if method is not None:
+                method(event)
+
+    def _load(self, key, url, params, path, args, event=None, conditional=True):
+        "Fetches, decodes and caches a response from the network"
+        started = _clock()
+        resp = self.transport.get(url, params=params,
+                                  headers=self._conditional_headers(key) if conditional else None)
+        if event is not None:
+            event.network = _clock() - started
+            event.status = resp.status_code
+            event.bytes = len(resp.content)
+            event.retries = getattr(resp, 'retries', 0)
+        try:
+            return self._handle(key, path, args, resp.status_code, resp.content,
+                                resp.headers, event)
+        except _Evicted:
+            return self._load(key, url, params, path, args, event, conditional=False)
+
+    def _with_cycle(self, args):
+        "Fills in the default cycle, the first argument of every path template"
+        if args and args[0] is None:
+            return (self.cycle,) + tuple(args[1:])
+        return args
+
+    def _prepare(self, path, args, kwargs):
+        "Returns the url, query params and parse function for a fetch"
+        if not kwargs.get('offset'):
             kwargs['offset'] = 0
         parse = kwargs.pop('parse', lambda r: r['results'][0])
         kwargs['api-key'] = self.apikey
@@ -48,51 +1429,240 @@ class Client(object):
             url = (url % args)
         else:
             url = path + '?'
-        
-        resp = requests.get(url, params = dict(kwargs))
-        if not resp.status_code in (200, 304):
-            content = resp.json
-            errors = '; '.join(e for e in content['errors'])
-            if resp.status_code == 404:
+        return url, dict(kwargs), parse
+
+    def _cache_key(self, url, params):
+        return _request_key(url, params)
+
+    def _ttl(self, path, args):
+        "Returns how long to cache a response for the given path template"
+        ttl = self.ttls.get(path, DEFAULT_TTL)
+        if path not in LIVE_ENDPOINTS and args:
+            try:
+                if int(args[0]) < self.cycle:
+                    ttl = max(ttl, CLOSED_CYCLE_TTL)
+            except (TypeError, ValueError):
+                pass
+        return ttl
+
+    def _store(self, key, body, path, args):
+        if self.cache:
+            self.cache.set(key, body, self._ttl(path, args))
+
+    def _is_cached(self, path, args):
+        "Whether fetch(path, *args) would be answered from the cache"
+        if not self.cache:
+            return False
+        url, params, parse = self._prepare(path, self._with_cycle(args), {})
+        return self._cache_key(url, params) in self.cache
+
+    def _get_many(self, method, path, ids, cycle, concurrency=None):
+        "Looks up several IDs within one cycle; returns a BatchResult keyed by ID"
+        calls = [(id, id, cycle) for id in OrderedDict.fromkeys(ids)]
+        return self._batch(method, path, calls, concurrency)
+
+    def _get_cycles(self, method, path, id, cycles, concurrency=None):
+        "Looks up one ID in several cycles; returns a BatchResult keyed by cycle"
+        calls = [(cycle, id, cycle) for cycle in OrderedDict.fromkeys(cycles)]
+        return self._batch(method, path, calls, concurrency)
+
+    def _batch(self, method, path, calls, concurrency=None):
+        """
+        Makes several method(id, cycle) calls, given as (key, id, cycle),
+        answering what it can from the cache and fetching the rest
+        concurrently; returns a BatchResult by key
+        """
+        def lookup(call):
+            key, id, cycle = call
+            try:
+                return key, method(id, cycle), None
+            except NytNotFoundError as e:
+                return key, None, e
+
+        cached = [call for call in calls if self._is_cached(path, (call[2], call[1]))]
+        found = [lookup(call) for call in cached]
+        missing = [call for call in calls if call not in cached]
+        if missing:
+            pool = _thread_pool(max(min(concurrency or self.concurrency,
+                                      self.concurrency, len(missing)), 1))
+            try:
+                found.extend(pool.map(lookup, missing))
+            finally:
+                pool.terminate()
+        found = dict((key, (record, error)) for key, record, error in found)
+
+        results = BatchResult()
+        for key, id, cycle in calls:
+            record, error = found[key]
+            if error is not None:
+                results.errors[key] = error
+            else:
+                results[key] = record
+        return results
+
+    def _conditional_headers(self, key):
+        if self.validators:
+            return self.validators.headers(key)
+
+    def _handle(self, key, path, args, status_code, body, headers, event=None):
+        "Decodes, checks and caches a response that came over the network"
+        if status_code == 304 and self.validators:
+            entry = self.validators.not_modified(key)
+            if entry is None:
+                # evicted by other requests while this one was out; the
+                # caller asks again without conditional headers
+                raise _Evicted(key)
+            self._store(key, entry.body, path, args)
+            if event is not None:
+                event.cache = 'revalidated'
+                event.bytes = len(entry.body)
+            return entry.result
+        try:
+            started = _clock()
+            result = self._decode(body)
+            if event is not None:
+                event.decode = _clock() - started
+        except ValueError:
+            # an error page rather than JSON, such as a proxy's or during
+            # maintenance; a 404 is still a 404
+            self._check(status_code, {})
+            raise NytCampfinError("HTTP %s: undecodable body" % status_code)
+        self._check(status_code, result)
+        self._store(key, body, path, args)
+        if self.validators:
+            self.validators.set(key, headers, body, result)
+        return result
+
+    def _decode(self, body):
+        return self.decoder(body)
+
+    def _check(self, status_code, content):
+        "Raises the matching error for an unsuccessful response"
+        if not status_code in (200, 304):
+            errors = '; '.join(e for e in content.get('errors') or
+                               ["HTTP %s" % status_code])
+            if status_code == 404:
                 raise NytNotFoundError(errors)
             else:
                 raise NytCampfinError(errors)
-        
-        result = resp.json
-        
+
+    def _parse(self, result, parse, url, path):
         if callable(parse):
             result = parse(result)
             if DEBUG:
                 result['_url'] = url
+        if self.typed and path in RECORD_TYPES and isinstance(result, (list, LazyRecords)):
+            result = [RECORD_TYPES[path].from_dict(record) for record in result]
         return result
 
+    def paginate(self, method, *args, **kwargs):
+        """
+        Lazily yields every record from an offset-based list method, one
+        page at a time, stopping after the first short page. Any arguments
+        besides the method are passed along to it.
+
+            >>> for filing in finance.paginate(finance.filings.date, 2012, 7, 4):
+            ...     print(filing['filing_id'])
+
+        Only one page is held in memory at a time. With prefetch=True the
+        next page is requested in the background while the current one is
+        being consumed.
+        """
+        prefetch = kwargs.pop('prefetch', False)
+        page_size = kwargs.pop('page_size', PAGE_SIZE)
+        offset = kwargs.pop('offset', 0) or 0
+
+        def fetch_page(offset):
+            return method(*args, offset=offset, **kwargs)
+
+        page = fetch_page(offset)
+        while True:
+            pending = None
+            if prefetch and len(page) >= page_size:
+                pending = _Prefetch(fetch_page, offset + page_size)
+            for record in page:
+                yield record
+            if len(page) < page_size:
+                return
+            offset += page_size
+            page = pending.result() if pending else fetch_page(offset)
+
+    def to_columns(self, method, *args, **kwargs):
+        """
+        Streams every record from an offset-based list method into Columns.
+        fields and numeric are passed to Columns; with bulk=True pages are
+        fetched concurrently, as by bulk(), and the rest is passed along
+        to the method.
+        """
+        columns = Columns(kwargs.pop('fields', None), kwargs.pop('numeric', None))
+        stream = self.bulk if kwargs.pop('bulk', False) else self.paginate
+        return columns.extend(stream(method, *args, **kwargs))
+
+    def bulk(self, method, *args, **kwargs):
+        """
+        Yields every record from an offset-based list method like paginate,
+        but keeps several pages in flight at once on a bounded thread pool.
+        Records come back in the same order paginate would produce them.
+
+            >>> contribs = list(finance.bulk(finance.committees.contributions, 'C00381277'))
+
+        concurrency defaults to, and is capped at, the client's concurrency
+        setting. Pages already requested past the first short page are
+        discarded.
+        """
+        concurrency = min(kwargs.pop('concurrency', None) or self.concurrency,
+                          self.concurrency)
+        page_size = kwargs.pop('page_size', PAGE_SIZE)
+        offset = kwargs.pop('offset', 0) or 0
+
+        def fetch_page(offset):
+            return method(*args, offset=offset, **kwargs)
+
+        pool = _thread_pool(max(concurrency, 1))
+        try:
+            pending = deque()
+            for i in range(max(concurrency, 1)):
+                pending.append(pool.apply_async(fetch_page, (offset,)))
+                offset += page_size
+            while pending:
+                page = pending.popleft().get()
+                if len(page) >= page_size:
+                    pending.append(pool.apply_async(fetch_page, (offset,)))
+                    offset += page_size
+                for record in page:
+                    yield record
+                if len(page) < page_size:
+                    return
+        finally:
+            pool.terminate()
+
 class FilingsClient(Client):
     
-    def today(self, cycle=CURRENT_CYCLE, offset=0):
+    def today(self, cycle=None, offset=0):
         "Returns today's FEC electronic filings"
         path = "/%s/filings"
         result = self.fetch(path, cycle, offset=offset, parse=lambda r: r['results'])
         return result
     
-    def date(self, year, month, day, cycle=CURRENT_CYCLE, offset=0):
+    def date(self, year, month, day, cycle=None, offset=0):
         "Returns electronic filings for a given date"
         path = "/%s/filings/%s/%s/%s"
         result = self.fetch(path, cycle, year, month, day, offset=offset, parse=lambda r: r['results'])
         return result
     
-    def form_types(self, cycle=CURRENT_CYCLE, offset=0):
+    def form_types(self, cycle=None, offset=0):
         "Returns an array of filing form types"
         path = "/%s/filings/types"
         result = self.fetch(path, cycle, offset=offset, parse=lambda r: r['results'])
         return result
         
-    def by_type(self, form_type, cycle=CURRENT_CYCLE, offset=0):
+    def by_type(self, form_type, cycle=None, offset=0):
         "Returns an array of electronic filings for a given form type"
         path = "/%s/filings/types/%s"
         result = self.fetch(path, cycle, form_type, offset=offset, parse=lambda r: r['results'])
         return result        
     
-    def amendments(self, cycle=CURRENT_CYCLE, offset=0):
+    def amendments(self, cycle=None, offset=0):
         "Returns an array of recent amendments"
         path = "/%s/filings/amendments"
         result = self.fetch(path, cycle, offset=offset, parse=lambda r: r['results'])
@@ -100,43 +1670,43 @@ class FilingsClient(Client):
         
 class IndependentExpenditureClient(Client):
     
-    def latest(self, cycle=CURRENT_CYCLE, offset=0):
+    def latest(self, cycle=None, offset=0):
         "Returns latest received independent expenditures"
         path = "/%s/independent_expenditures"
         result = self.fetch(path, cycle, offset=offset, parse=lambda r: r['results'])
         return result
 
-    def date(self, year, month, day, cycle=CURRENT_CYCLE, offset=0):
+    def date(self, year, month, day, cycle=None, offset=0):
         "Returns independent expenditures made on a given date"
         path = "/%s/independent_expenditures/%s/%s/%s"
         result = self.fetch(path, cycle, year, month, day, offset=offset, parse=lambda r: r['results'])
         return result
 
-    def committee(self, cmte_id, cycle=CURRENT_CYCLE, offset=0):
+    def committee(self, cmte_id, cycle=None, offset=0):
         "Returns a list of a committee's independent expenditures within a cycle"
         path = "/%s/committees/%s/independent_expenditures"
         result = self.fetch(path, cycle, cmte_id, offset=offset, parse=lambda r: r['results'])
         return result
 
-    def candidate(self, cand_id, cycle=CURRENT_CYCLE, offset=0):
+    def candidate(self, cand_id, cycle=None, offset=0):
         "Returns a list of independent expenditures about a candidate within a cycle"
         path = "/%s/candidates/%s/independent_expenditures"
         result = self.fetch(path, cycle, cand_id, offset=offset, parse=lambda r: r['results'])
         return result
 
-    def president(self, cycle=CURRENT_CYCLE, offset=0):
+    def president(self, cycle=None, offset=0):
         "Returns a list of independent expenditures about presidential candidates within a cycle"
         path = "/%s/president/independent_expenditures"
         result = self.fetch(path, cycle, offset=offset, parse=lambda r: r['results'])
         return result
 
-    def superpacs(self, cycle=CURRENT_CYCLE, offset=0):
+    def superpacs(self, cycle=None, offset=0):
         "Returns a list of independent expenditures about presidential candidates within a cycle"
         path = "/%s/committees/superpacs"
         result = self.fetch(path, cycle, offset=offset, parse=lambda r: r['results'])
         return result
         
-    def race_totals(self, office, cycle=CURRENT_CYCLE, offset=0):
+    def race_totals(self, office, cycle=None, offset=0):
         "Returns a list of races and the total amount of independent expenditures for the cycle"
         path = "/%s/independent_expenditures/race_totals/%s"
         result = self.fetch(path, cycle, office, offset=offset, parse=lambda r: r['results'])
@@ -144,37 +1714,47 @@ class IndependentExpenditureClient(Client):
 
 class CandidatesClient(Client):
     
-    def latest(self, cycle=CURRENT_CYCLE, offset=0):
+    def latest(self, cycle=None, offset=0):
         "Returns newly registered candidates"
         path = "/%s/candidates/new"
         result = self.fetch(path, cycle, offset=offset, parse=lambda r: r['results'])
         return result
         
-    def get(self, cand_id, cycle=CURRENT_CYCLE, offset=0):
+    def get(self, cand_id, cycle=None, offset=0):
         "Returns details for a single candidate within a cycle"
         path = "/%s/candidates/%s"
         result = self.fetch(path, cycle, cand_id, offset=offset)
         return result
 
-    def filter(self, query, cycle=CURRENT_CYCLE, offset=0):
+    def get_many(self, cand_ids, cycle=None, concurrency=None):
+        "Returns details for several candidates within a cycle, keyed by ID"
+        path = "/%s/candidates/%s"
+        return self._get_many(self.get, path, cand_ids, cycle, concurrency)
+
+    def get_cycles(self, cand_id, cycles, concurrency=None):
+        "Returns details for a candidate in several cycles, keyed by cycle"
+        path = "/%s/candidates/%s"
+        return self._get_cycles(self.get, path, cand_id, cycles, concurrency)
+
+    def filter(self, query, cycle=None, offset=0):
         "Returns a list of candidates based on a search term"
         path = "/%s/candidates/search"
         result = self.fetch(path, cycle, query=query, offset=offset, parse=lambda r: r['results'])
         return result
         
-    def late_contributions(self, cand_id, cycle=CURRENT_CYCLE, offset=0):
+    def late_contributions(self, cand_id, cycle=None, offset=0):
         "Returns a list of 48-hour contributions to the given candidate"
         path = "/%s/candidates/%s/48hour"
         result = self.fetch(path, cycle, cand_id, offset=offset, parse=lambda r: r['results'])
         return result
     
-    def leaders(self, category, cycle=CURRENT_CYCLE, offset=0):
+    def leaders(self, category, cycle=None, offset=0):
         "Returns a list of leading candidates in a given category"
         path = "/%s/candidates/leaders/%s"
         result = self.fetch(path, cycle, category, offset=offset, parse=lambda r: r['results'])
         return result
     
-    def seats(self, state, chamber=None, district=None, cycle=CURRENT_CYCLE, offset=0):
+    def seats(self, state, chamber=None, district=None, cycle=None, offset=0):
         "Returns an array of candidates for seats in the specified state and optional chamber and district"
         if district:
             path = "/%s/seats/%s/%s/%s"
@@ -189,55 +1769,65 @@ class CandidatesClient(Client):
 
 class CommitteesClient(Client):
     
-    def latest(self, cycle=CURRENT_CYCLE, offset=0):
+    def latest(self, cycle=None, offset=0):
         "Returns newly registered committees"
         path = "/%s/committees/new"
         result = self.fetch(path, cycle, offset=offset, parse=lambda r: r['results'])
         return result
     
-    def get(self, cmte_id, cycle=CURRENT_CYCLE, offset=0):
+    def get(self, cmte_id, cycle=None, offset=0):
         "Returns details for a single committee within a cycle"
         path = "/%s/committees/%s"
         result = self.fetch(path, cycle, cmte_id, offset=offset)
         return result
     
-    def filter(self, query, cycle=CURRENT_CYCLE, offset=0):
+    def get_many(self, cmte_ids, cycle=None, concurrency=None):
+        "Returns details for several committees within a cycle, keyed by ID"
+        path = "/%s/committees/%s"
+        return self._get_many(self.get, path, cmte_ids, cycle, concurrency)
+
+    def get_cycles(self, cmte_id, cycles, concurrency=None):
+        "Returns details for a committee in several cycles, keyed by cycle"
+        path = "/%s/committees/%s"
+        return self._get_cycles(self.get, path, cmte_id, cycles, concurrency)
+
+    def filter(self, query, cycle=None, offset=0):
         "Returns a list of committees based on a search term"
         path = "/%s/committees/search"
         result = self.fetch(path, cycle, query=query, offset=offset, parse=lambda r: r['results'])
         return result
 
-    def late_contributions(self, cmte_id, cycle=CURRENT_CYCLE, offset=0):
+    def late_contributions(self, cmte_id, cycle=None, offset=0):
         "Returns a list of 48-hour contributions to the given candidate committee"
         path = "/%s/committees/%s/48hour"
         result = self.fetch(path, cycle, cmte_id, offset=offset, parse=lambda r: r['results'])
         return result
 
-    def filings(self, cmte_id, cycle=CURRENT_CYCLE, offset=0):
+    def filings(self, cmte_id, cycle=None, offset=0):
         "Returns a list of a committee's filing within a cycle"
         path = "/%s/committees/%s/filings"
         result = self.fetch(path, cycle, cmte_id, offset=offset, parse=lambda r: r['results'])
         return result
 
-    def contributions(self, cmte_id, cycle=CURRENT_CYCLE, offset=0):
+    def contributions(self, cmte_id, cycle=None, offset=0):
         "Returns a list of a committee's contributions within a cycle"
         path = "/%s/committees/%s/contributions"
         result = self.fetch(path, cycle, cmte_id, offset=offset, parse=lambda r: r['results'])
         return result
 
-    def contributions_to_candidate(self, cmte_id, candidate_id, cycle=CURRENT_CYCLE, offset=0):
+    def contributions_to_candidate(self, cmte_id, candidate_id, cycle=None, offset=0):
         "Returns a list of a committee's contributions to a given candidate within a cycle"
         path = "/%s/committees/%s/contributions/candidates/%s"
         result = self.fetch(path, cycle, cmte_id, candidate_id, offset=offset, parse=lambda r: r['results'])
         return result
         
-    def ie_totals(self, cmte_id, cycle=CURRENT_CYCLE, offset=0):
+    def ie_totals(self, cmte_id, cycle=None, offset=0):
         "Returns a list of races where the given committee has done independent expenditures"
         path = "/%s/committees/%s/independent_expenditures/races"
         result = self.fetch(path, cycle, cmte_id, offset=offset, parse=lambda r: r['results'])
         return result
         
-    def leadership(self, cycle=CURRENT_CYCLE, offset=0):
+    def leadership(self, cycle=None, offset=0):
         "Returns a list of leadership committees"
         path = "/%s/committees/leadership"
         result = self.fetch(path, cycle, offset=offset, parse=lambda r: r['results'])
@@ -245,25 +1835,35 @@ class CommitteesClient(Client):
 
 class PresidentClient(Client):
     
-    def candidates(self, cycle=CURRENT_CYCLE, offset=0):
+    def candidates(self, cycle=None, offset=0):
         "Returns a list of presidential candidates with top-level totals"
         path = "/%s/president/totals"
         result = self.fetch(path, cycle, offset=offset, parse=lambda r: r['results'])
         return result
     
-    def detail(self, candidate_id, cycle=CURRENT_CYCLE, offset=0):
+    def detail(self, candidate_id, cycle=None, offset=0):
         "Returns financial details for a presidential candidate, using either FEC committee ID or last name as a param"
         path = "/%s/president/candidates/%s"
         result = self.fetch(path, cycle, candidate_id, offset=offset)
         return result
     
-    def state(self, state_abbrev, cycle=CURRENT_CYCLE, offset=0):
+    def detail_many(self, candidate_ids, cycle=None, concurrency=None):
+        "Returns financial details for several presidential candidates, keyed by ID or name"
+        path = "/%s/president/candidates/%s"
+        return self._get_many(self.detail, path, candidate_ids, cycle, concurrency)
+
+    def detail_cycles(self, candidate_id, cycles, concurrency=None):
+        "Returns financial details for a presidential candidate in several cycles, keyed by cycle"
+        path = "/%s/president/candidates/%s"
+        return self._get_cycles(self.detail, path, candidate_id, cycles, concurrency)
+
+    def state(self, state_abbrev, cycle=None, offset=0):
         "Returns state totals for presidential candidates"
         path = "/%s/president/states/%s"
         result = self.fetch(path, cycle, state_abbrev, offset=offset, parse=lambda r: r['results'])
         return result
     
-    def zipcode(self, zipcode, cycle=CURRENT_CYCLE, offset=0):
+    def zipcode(self, zipcode, cycle=None, offset=0):
         "Returns zip code totals for presidential candidates"
         path = "/%s/president/zips/%s"
         result = self.fetch(path, cycle, zipcode, offset=offset, parse=lambda r: r['results'])
@@ -271,19 +1871,37 @@ class PresidentClient(Client):
 
 class LateContributionClient(Client):
     
-    def latest(self, cycle=CURRENT_CYCLE, offset=0):
+    def latest(self, cycle=None, offset=0):
         "Returns most recent 48-hour contributions"
         path = "/%s/contributions/48hour"
         result = self.fetch(path, cycle, offset=offset, parse=lambda r: r['results'])
         return result
     
-    def date(self, year, month, day, cycle=CURRENT_CYCLE, offset=0):
+    def date(self, year, month, day, cycle=None, offset=0):
         "Returns 48-hour contributions made on a given date"
         path = "/%s/contributions/48hour/%s/%s/%s"
         result = self.fetch(path, cycle, year, month, day, offset=offset, parse=lambda r: r['results'])
         return result
 
 
+class _SubClient(object):
+    """
+    A namespace attribute whose sub-client is built on first access and
+    then kept in the instance's __dict__, so later lookups skip this
+    """
+
+    def __init__(self, name, cls):
+        self.name = name
+        self.cls = cls
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        # threads racing here agree on whichever sub-client lands first
+        return instance.__dict__.setdefault(self.name,
+                                            instance._subclient(self.cls))
+
+
 class NytCampfin(Client):
     """
     Implements the public interface for the NYT Campaign Finance API
@@ -299,17 +1917,860 @@ class NytCampfin(Client):
     Create a new instance with your API key, or set an environment
     variable and pass that in.
 
-    NytCampfin uses requests and the requests-cache library. By default,
-    it uses a sqlite database named cache.sqlite, but other cache options
-    may be used.
+    NytCampfin uses requests, and caches responses in memory for
+    DEFAULT_TTL seconds, or the per-endpoint time given in TTLS (or your
+    own ttls mapping of path templates to seconds). Pass a SqliteCache or
+    DirectoryCache to keep responses on disk, or cache=False to turn
+    caching off:
+
+        >>> finance = NytCampfin(apikey, cache=SqliteCache('cache.sqlite'))
+        >>> finance.cache.stats()
+
+    Once a cached response expires it is refetched with If-None-Match and
+    If-Modified-Since; on a 304 the previously decoded result is reused, so
+    treat results as read-only. finance.validators.stats() reports the
+    bytes and JSON parses saved. Pass validators=False to turn this off.
+
+    Identical requests made by several threads at once are sent only once
+    and share the decoded result; finance.inflight.coalesced counts them.
+
+    Responses are decoded with orjson or ujson when installed, falling back
+    to the json module, or with your own decoder, any function taking the
+    raw body. decoder=lazy_loads leaves the records of list responses
+    undecoded until they are accessed.
+
+    With typed=True, filings, independent expenditures and 48-hour
+    contributions come back as compact Filing, IndependentExpenditure and
+    LateContribution records rather than dicts.
+
+    All sub-clients share a single pooled Transport. Pass your own to
+    change pool size, retries or timeout:
+
+        >>> transport = Transport(pool_maxsize=20, max_retries=3, timeout=10)
+        >>> finance = NytCampfin(apikey, transport=transport)
+        >>> finance.transport.stats()
+
+    concurrency caps the number of requests a single bulk() call keeps in
+    flight; keep it at or below the transport's pool_maxsize.
+
+    Methods take a cycle, defaulting to the client's cycle (CURRENT_CYCLE
+    unless given). Responses for earlier cycles are cached for
+    CLOSED_CYCLE_TTL. get_cycles and detail_cycles fetch one committee or
+    candidate in several cycles at once:
+
+        >>> finance = NytCampfin(apikey, cycle=2016)
+        >>> cmtes = finance.committees.get_cycles('C00431445', [2008, 2012, 2016])
+        >>> cmtes[2012]['name'], cmtes.errors
+
+    hooks is a list of objects with before_request and/or after_request
+    methods, called with a RequestEvent around every fetch; Metrics is one
+    that reports latency percentiles per endpoint.
+
+    preload names a snapshot, a SqliteCache path, shared by workers on the
+    host: reference endpoints are loaded from it into the cache at once and
+    kept fresh from a background thread. See WarmStart.
+
+    Sub-clients are built on first access, and the transport opens its
+    session on the first request, so a client is cheap to create.
+
+    To work offline, point base_uri at a local stand-in for the API such as
+    nytcampfin_stub, or replay recorded responses with a FixtureTransport.
     """
+
+    filings = _SubClient('filings', FilingsClient)
+    committees = _SubClient('committees', CommitteesClient)
+    candidates = _SubClient('candidates', CandidatesClient)
+    president = _SubClient('president', PresidentClient)
+    indexp = _SubClient('indexp', IndependentExpenditureClient)
+    late_contribs = _SubClient('late_contribs', LateContributionClient)
     
-    def __init__(self, apikey):
-        super(NytCampfin, self).__init__(apikey)
-        self.filings = FilingsClient(self.apikey)
-        self.committees = CommitteesClient(self.apikey)
-        self.candidates = CandidatesClient(self.apikey)
-        self.president = PresidentClient(self.apikey)
-        self.indexp = IndependentExpenditureClient(self.apikey)
-        self.late_contribs = LateContributionClient(self.apikey)
+    def __init__(self, apikey, transport=None, concurrency=CONCURRENCY,
+                 cache=None, ttls=None, validators=None, inflight=None,
+                 decoder=None, typed=False, base_uri=None, hooks=None,
+                 cycle=None, preload=None):
+        super(NytCampfin, self).__init__(apikey, transport, concurrency,
+                                         cache, ttls, validators, inflight,
+                                         decoder, typed, base_uri, hooks, cycle)
+        self.warm_start = WarmStart(self, preload).start() if preload else None
+
+    def _subclient(self, cls):
+        "Builds a sub-client that shares this client's settings"
+        return cls(self.apikey, transport=self.transport,
+                   concurrency=self.concurrency, cache=self.cache,
+                   ttls=self.ttls, validators=self.validators,
+                   inflight=self.inflight, decoder=self.decoder,
+                   typed=self.typed, base_uri=self.BASE_URI,
+                   hooks=self.hooks, cycle=self.cycle)
+
+
+# Feeds
+
+def _filing_key(record):
+    return record['filing_id']
+
+def _transaction_key(record):
+    # FEC filing ids grow in the order filings are received
+    return (int(record.get('fec_filing_id') or 0), record.get('transaction_id') or '')
+
+# Newest-first feeds a Watcher knows how to poll: name -> (sub-client,
+# method, function returning a record's high-water mark key)
+FEEDS = {
+    'filings': ('filings', 'today', _filing_key),
+    'independent_expenditures': ('indexp', 'latest', _transaction_key),
+    'late_contributions': ('late_contribs', 'latest', _transaction_key),
+}
+
+class Watcher(object):
+    """
+    Polls newest-first feeds and yields only records not seen before
+
+    A high-water mark, the largest key seen so far, is kept for every feed
+    and saved to the JSON file at path, if given, so it survives restarts.
+    Each poll pages through the feed only until it reaches records at or
+    below the mark:
+
+        >>> watcher = Watcher(finance, 'watermarks.json')
+        >>> for filing in watcher.poll('filings'):
+        ...     process(filing)
+
+    The mark only advances once a poll has been consumed to the end and
+    has reached the old mark (or the end of the feed), so a crash mid-poll
+    means those records are yielded again, never skipped. Likewise a poll
+    cut short by max_pages leaves the mark where it was.
+
+    feed is one of the names in FEEDS, or any method taking an offset
+    together with a key function and a name to store its mark under.
+    """
+
+    def __init__(self, client, path=None):
+        self.client = client
+        self.path = path
+        self.marks = self._load()
+
+    def _load(self):
+        if not (self.path and os.path.exists(self.path)):
+            return {}
+        with open(self.path) as f:
+            marks = json.load(f)
+        return dict((name, tuple(mark) if isinstance(mark, list) else mark)
+                    for name, mark in marks.items())
+
+    def save(self):
+        if self.path:
+            tmp = '%s.%s' % (self.path, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump(self.marks, f)
+            _replace(tmp, self.path)
+
+    def poll(self, feed, key=None, name=None, max_pages=None, **kwargs):
+        "Yields records newer than feed's high-water mark, newest first"
+        if isinstance(feed, string_types):
+            namespace, method, default_key = FEEDS[feed]
+            name = name or '%s/%s' % (feed, kwargs.get('cycle') or self.client.cycle)
+            key = key or default_key
+            feed = getattr(getattr(self.client, namespace), method)
+        elif name is None:
+            raise ValueError("a feed given as a method needs a name to keep its mark under")
+        mark = self.marks.get(name)
+        newest = mark
+        offset = 0
+        pages = 0
+        while True:
+            page = feed(offset=offset, **kwargs)
+            pages += 1
+            caught_up = len(page) < PAGE_SIZE
+            for record in page:
+                record_key = key(record)
+                if mark is not None and record_key <= mark:
+                    caught_up = True
+                    continue
+                if newest is None or record_key > newest:
+                    newest = record_key
+                yield record
+            if caught_up or pages == max_pages:
+                break
+            offset += PAGE_SIZE
+        if caught_up and newest != mark:
+            self.marks[name] = newest
+            self.save()
+
+    def watch(self, feed, interval=60, **kwargs):
+        "Polls feed every interval seconds, forever, yielding new records"
+        while True:
+            for record in self.poll(feed, **kwargs):
+                yield record
+            time.sleep(interval)
+
+# Local mirror
+
+STATES = ('AK', 'AL', 'AR', 'AZ', 'CA', 'CO', 'CT', 'DC', 'DE', 'FL', 'GA',
+          'HI', 'IA', 'ID', 'IL', 'IN', 'KS', 'KY', 'LA', 'MA', 'MD', 'ME',
+          'MI', 'MN', 'MO', 'MS', 'MT', 'NC', 'ND', 'NE', 'NH', 'NJ', 'NM',
+          'NV', 'NY', 'OH', 'OK', 'OR', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX',
+          'UT', 'VA', 'VT', 'WA', 'WI', 'WV', 'WY')
+
+# Resources a Mirror syncs: name -> (sub-client, method, whether it is
+# fetched once per state). Every one is paged to the end; for the short
+# ones that is the one request anyway.
+MIRRORED = {
+    'filings.form_types': ('filings', 'form_types', False),
+    'candidates.seats': ('candidates', 'seats', True),
+    'committees.leadership': ('committees', 'leadership', False),
+    'indexp.superpacs': ('indexp', 'superpacs', False),
+    'president.candidates': ('president', 'candidates', False),
+    'president.state': ('president', 'state', True),
+}
+
+# Fields, in order of preference, that fill a mirrored record's indexed columns
+INDEXED_FIELDS = (
+    ('fec_id', ('id', 'fec_id', 'committee_id', 'fec_committee_id', 'candidate_id',
+                'fec_candidate_id')),
+    ('state', ('state',)),
+    ('date', ('date', 'date_filed', 'date_coverage_to')),
+    ('form_type', ('form_type', 'form_id')),
+)
+
+class _MirrorClient(object):
+
+    def __init__(self, mirror):
+        self.mirror = mirror
+
+class _MirrorFilings(_MirrorClient):
+
+    def form_types(self, cycle=None):
+        return self.mirror.query('filings.form_types', cycle)
+
+class _MirrorCandidates(_MirrorClient):
+
+    def seats(self, state, chamber=None, district=None, cycle=None):
+        "Filters the state's seats on their chamber and district fields"
+        seats = self.mirror.query('candidates.seats', cycle, state)
+        if chamber:
+            seats = [s for s in seats if str(s.get('chamber', '')).lower() == chamber.lower()]
+        if district:
+            seats = [s for s in seats if str(s.get('district')) == str(district)]
+        return seats
+
+class _MirrorCommittees(_MirrorClient):
+
+    def leadership(self, cycle=None):
+        return self.mirror.query('committees.leadership', cycle)
+
+class _MirrorIndependentExpenditures(_MirrorClient):
+
+    def superpacs(self, cycle=None):
+        return self.mirror.query('indexp.superpacs', cycle)
+
+class _MirrorPresident(_MirrorClient):
+
+    def candidates(self, cycle=None):
+        return self.mirror.query('president.candidates', cycle)
+
+    def state(self, state_abbrev, cycle=None):
+        return self.mirror.query('president.state', cycle, state_abbrev)
+
+class Mirror(object):
+    """
+    A local, indexed SQLite copy of the slow-changing endpoints in MIRRORED
+
+        >>> mirror = Mirror(finance, 'campfin.sqlite')
+        >>> mirror.sync(2012)
+        {'fetched': 106, 'changed': 106, 'unchanged': 0, 'skipped': 0}
+        >>> mirror.president.state('AZ', 2012)
+
+    Reads go through namespaces that mirror the client's (filings,
+    candidates, committees, indexp and president) but never touch the
+    network. lookup() finds records by FEC ID across everything mirrored.
+
+    sync fetches its resources concurrently. Later syncs are incremental:
+    a resource synced less than max_age seconds ago (an hour by default)
+    is skipped, and one whose records haven't changed isn't rewritten.
+    Pass max_age=0 to refetch everything.
+    """
+
+    def __init__(self, client, path='mirror.sqlite'):
+        self.client = client
+        self.path = path
+        self._db = None
+        self._lock = threading.Lock()
+        self.filings = _MirrorFilings(self)
+        self.candidates = _MirrorCandidates(self)
+        self.committees = _MirrorCommittees(self)
+        self.indexp = _MirrorIndependentExpenditures(self)
+        self.president = _MirrorPresident(self)
+
+    @property
+    def db(self):
+        if self._db is None:
+            import sqlite3
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS records (
+                    resource TEXT, cycle INTEGER, arg TEXT, position INTEGER,
+                    fec_id TEXT, state TEXT, date TEXT, form_type TEXT, data TEXT,
+                    PRIMARY KEY (resource, cycle, arg, position));
+                CREATE INDEX IF NOT EXISTS records_fec_id ON records (fec_id);
+                CREATE INDEX IF NOT EXISTS records_state ON records (state);
+                CREATE INDEX IF NOT EXISTS records_date ON records (date);
+                CREATE INDEX IF NOT EXISTS records_form_type ON records (form_type);
+                CREATE TABLE IF NOT EXISTS syncs (
+                    resource TEXT, cycle INTEGER, arg TEXT, digest TEXT, synced_at REAL,
+                    PRIMARY KEY (resource, cycle, arg));
+            """)
+        return self._db
+
+    def _units(self, cycle, resources):
+        for resource in resources:
+            by_state = MIRRORED[resource][2]
+            for arg in (STATES if by_state else ('',)):
+                yield resource, cycle, arg
+
+    def _fetch(self, unit):
+        resource, cycle, arg = unit
+        namespace, method, by_state = MIRRORED[resource]
+        method = getattr(getattr(self.client, namespace), method)
+        args = (arg,) if by_state else ()
+        try:
+            return unit, list(self.client.paginate(method, *args, cycle=cycle))
+        except NytNotFoundError:
+            return unit, []
+
+    def sync(self, cycle=None, resources=None, max_age=60 * 60):
+        "Copies resources (all of MIRRORED by default) for cycle into the mirror"
+        cycle = int(cycle or self.client.cycle)
+        counts = {'fetched': 0, 'changed': 0, 'unchanged': 0, 'skipped': 0}
+        with self._lock:
+            synced = dict(((r, c, a), (digest, at)) for r, c, a, digest, at in
+                          self.db.execute("SELECT * FROM syncs WHERE cycle = ?", (cycle,)))
+        units = []
+        for unit in self._units(cycle, sorted(resources or MIRRORED)):
+            if unit in synced and time.time() - synced[unit][1] < max_age:
+                counts['skipped'] += 1
+            else:
+                units.append(unit)
+
+        pool = _thread_pool(max(min(self.client.concurrency, len(units)), 1))
+        try:
+            for unit, records in pool.imap_unordered(self._fetch, units):
+                counts['fetched'] += 1
+                data = [json.dumps(r.to_dict() if isinstance(r, Record) else r,
+                                   sort_keys=True) for r in records]
+                digest = hashlib.sha1('\n'.join(data).encode('utf-8')).hexdigest()
+                changed = unit not in synced or synced[unit][0] != digest
+                counts['changed' if changed else 'unchanged'] += 1
+                self._write(unit, records, data, digest, changed)
+        finally:
+            pool.terminate()
+        return counts
+
+    def _write(self, unit, records, data, digest, changed):
+        with self._lock:
+            with self.db:
+                if changed:
+                    self.db.execute("DELETE FROM records WHERE resource = ? AND cycle = ? AND arg = ?", unit)
+                    self.db.executemany(
+                        "INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        [unit + (position,) + self._indexed(unit, record) + (row,)
+                         for position, (record, row) in enumerate(zip(records, data))])
+                self.db.execute("INSERT OR REPLACE INTO syncs VALUES (?, ?, ?, ?, ?)",
+                                unit + (digest, time.time()))
+
+    def _indexed(self, unit, record):
+        values = []
+        for column, fields in INDEXED_FIELDS:
+            value = None
+            for field in fields:
+                value = record.get(field)
+                if value is not None:
+                    break
+            if column == 'state' and value is None and unit[2]:
+                value = unit[2]
+            values.append(str(value) if value is not None else None)
+        return tuple(values)
+
+    def query(self, resource, cycle=None, arg=''):
+        "Returns the mirrored records of one resource, in API order"
+        cycle = int(cycle or self.client.cycle)
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT data FROM records WHERE resource = ? AND cycle = ? AND arg = ? "
+                "ORDER BY position", (resource, cycle, arg)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def lookup(self, fec_id, cycle=None):
+        "Returns every mirrored record with the given FEC ID, by resource"
+        sql = "SELECT resource, data FROM records WHERE fec_id = ?"
+        params = (fec_id,)
+        if cycle is not None:
+            sql += " AND cycle = ?"
+            params += (int(cycle),)
+        with self._lock:
+            rows = self.db.execute(sql, params).fetchall()
+        found = {}
+        for resource, data in rows:
+            found.setdefault(resource, []).append(json.loads(data))
+        return found
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+# Warm start
+
+# Stable endpoints a WarmStart preloads: name -> (sub-client, method, path template)
+REFERENCE_ENDPOINTS = {
+    'filings.form_types': ('filings', 'form_types', "/%s/filings/types"),
+    'committees.leadership': ('committees', 'leadership', "/%s/committees/leadership"),
+    'indexp.superpacs': ('indexp', 'superpacs', "/%s/committees/superpacs"),
+    'president.candidates': ('president', 'candidates', "/%s/president/totals"),
+}
+
+class WarmStart(object):
+    """
+    Preloads a client's cache with reference endpoints from a snapshot on
+    disk, and keeps the snapshot fresh in the background
+
+        >>> finance = NytCampfin(apikey, preload='reference.sqlite')
+
+    The snapshot is a SqliteCache that every worker on a host can share.
+    load() copies its fresh entries for the endpoints (REFERENCE_ENDPOINTS
+    by default, in the client's cycle) into the client's cache in a single
+    query. start() does that, then refetches every page of the endpoints
+    that were stale or missing from a background thread, writing them to
+    the snapshot too, and checks again every interval seconds. An endpoint
+    that fails to refresh is kept in errors and retried on the next check.
+    A worker started after that reaches the API only for what it actually
+    needs.
+    """
+
+    def __init__(self, client, snapshot='reference.sqlite', endpoints=None, interval=60):
+        if not client.cache:
+            raise ValueError("a warm start needs a client with a cache")
+        self.client = client
+        self.snapshot = snapshot if isinstance(snapshot, Cache) else SqliteCache(snapshot)
+        self.endpoints = sorted(endpoints or REFERENCE_ENDPOINTS)
+        self.interval = interval
+        self.loaded = 0
+        self.refreshed = 0
+        self.errors = {}
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _url(self, name):
+        path = REFERENCE_ENDPOINTS[name][2]
+        return self.client._prepare(path, (self.client.cycle,), {})[0]
+
+    def load(self):
+        """
+        Copies fresh snapshot entries into the client's cache; returns the
+        endpoints with pages that are stale or missing
+        """
+        urls = dict((self._url(name), name) for name in self.endpoints)
+        now = time.time()
+        fresh, stale = set(), set()
+        for key, body, expires in self.snapshot.entries(list(urls)):
+            name = urls[key.partition('?')[0]]
+            if expires > now:
+                self.client.cache.set(key, body, expires - now)
+                self.loaded += 1
+                fresh.add(name)
+            else:
+                stale.add(name)
+        return [name for name in self.endpoints if name in stale or name not in fresh]
+
+    def refresh(self, endpoints=None):
+        """
+        Fetches every page of the endpoints and saves them to the snapshot;
+        an endpoint that fails is kept in errors until it next succeeds
+        """
+        for name in self.endpoints if endpoints is None else endpoints:
+            try:
+                self._refresh(name)
+            except (NytCampfinError, EnvironmentError) as e:
+                # requests' connection errors and timeouts are EnvironmentErrors
+                # too; they fail this endpoint, not the ones after it
+                self.errors[name] = e
+            else:
+                self.errors.pop(name, None)
+                self.refreshed += 1
+
+    def _refresh(self, name):
+        namespace, method, path = REFERENCE_ENDPOINTS[name]
+        method = getattr(getattr(self.client, namespace), method)
+        records = sum(1 for record in self.client.paginate(method))
+        for offset in range(0, records + 1, PAGE_SIZE):
+            url, params, parse = self.client._prepare(path, (self.client.cycle,),
+                                                      {'offset': offset})
+            key = self.client._cache_key(url, params)
+            entry = self.client.cache.entry(key)
+            if entry is not None:
+                self.snapshot.set(key, entry[0], entry[1] - time.time())
+
+    def start(self):
+        "Loads the snapshot, then refreshes it from a background thread"
+        stale = self.load()
+        self._thread = threading.Thread(target=self._run, args=(stale,))
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def _run(self, stale):
+        while True:
+            try:
+                self.refresh(stale)
+            except Exception as e: # keep refreshing through network trouble
+                self.error = e
+            if self._stop.wait(self.interval):
+                return
+            stale = self.load()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+# Export
+
+def _plain(record):
+    return record.to_dict() if isinstance(record, Record) else record
+
+def _csv_value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True)
+    if value is None:
+        return ''
+    if str is bytes and isinstance(value, string_types) and not isinstance(value, bytes):
+        return value.encode('utf-8') # Python 2's csv module only writes bytes
+    return value
+
+def _csv_lines(rows):
+    import csv
+    buf = io.BytesIO() if str is bytes else io.StringIO()
+    writer = csv.writer(buf, lineterminator='\n')
+    for row in rows:
+        writer.writerow([_csv_value(value) for value in row])
+    data = buf.getvalue()
+    return data if isinstance(data, bytes) else data.encode('utf-8')
+
+def _gzip(data):
+    import gzip
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+def _job(method, args, kwargs):
+    "Names an export, so a checkpoint isn't resumed by a different one"
+    owner = getattr(method, '__self__', None)
+    name = method.__name__
+    if owner is not None:
+        name = '%s.%s' % (type(owner).__name__, name)
+    return '%s%r' % (name, tuple(str(arg) for arg in args) +
+                     tuple(sorted((k, str(v)) for k, v in kwargs.items())))
+
+def export(method, path, *args, **kwargs):
+    """
+    Streams every record from an offset-based list method to a file,
+    one page at a time, and returns the number of records written
+
+        >>> export(finance.committees.contributions, 'contribs.csv.gz', 'C00381277')
+
+    format is 'ndjson' or 'csv', and compress gzips the output; both are
+    guessed from the file name when not given. CSV columns are fields, or
+    the keys of the first record; nested values are written as JSON.
+
+    After each page is written and flushed, the next offset is saved to
+    checkpoint (path + '.checkpoint' by default). With resume=True a
+    crashed export picks up from there, dropping anything written after
+    the last checkpoint. Other arguments are passed to the method.
+    """
+    fmt = kwargs.pop('format', None)
+    compress = kwargs.pop('compress', None)
+    fields = kwargs.pop('fields', None)
+    checkpoint = kwargs.pop('checkpoint', None) or path + '.checkpoint'
+    resume = kwargs.pop('resume', False)
+    page_size = kwargs.pop('page_size', PAGE_SIZE)
+    offset = kwargs.pop('offset', 0) or 0
+    name = path[:-3] if path.endswith('.gz') else path
+    if compress is None:
+        compress = path.endswith('.gz')
+    if fmt is None:
+        fmt = 'csv' if name.endswith('.csv') else 'ndjson'
+    if fmt not in ('ndjson', 'csv'):
+        raise ValueError("format must be 'ndjson' or 'csv'")
+
+    job = _job(method, args, kwargs)
+    state = {'job': job, 'offset': offset, 'records': 0, 'bytes': 0,
+             'fields': fields, 'complete': False}
+    if resume and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            saved = json.load(f)
+        if saved['job'] != job:
+            raise ValueError("%s is the checkpoint of %s" % (checkpoint, saved['job']))
+        state = saved
+    if state['complete']:
+        return state['records']
+
+    with open(path, 'r+b' if state['bytes'] else 'wb') as out:
+        out.seek(state['bytes'])
+        out.truncate()
+        while True:
+            page = method(*args, offset=state['offset'], **kwargs)
+            records = [_plain(record) for record in page]
+            if fmt == 'csv':
+                rows = []
+                if records and not state['bytes']:
+                    state['fields'] = state['fields'] or list(records[0].keys())
+                    rows.append(state['fields'])
+                rows.extend([record.get(field) for field in state['fields']]
+                            for record in records)
+                chunk = _csv_lines(rows)
+            else:
+                chunk = b''.join(json.dumps(record, sort_keys=True).encode('utf-8') + b'\n'
+                                 for record in records)
+            if compress and chunk:
+                chunk = _gzip(chunk) # one member per page, so a resumed file stays valid
+            out.write(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+
+            state['bytes'] += len(chunk)
+            state['records'] += len(records)
+            state['offset'] += page_size
+            state['complete'] = len(page) < page_size
+            tmp = checkpoint + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            _replace(tmp, checkpoint)
+            if state['complete']:
+                return state['records']
+
+# Crawling
+
+# Methods a backfill walks for every date...
+DATED_METHODS = ('filings.date', 'indexp.date', 'late_contribs.date')
+
+# ...and for every committee
+COMMITTEE_METHODS = ('committees.filings', 'committees.contributions')
+
+class CrawlUnit(namedtuple('CrawlUnit', 'method args')):
+    "One method call, walked through every page, that a Crawl runs"
+
+    @property
+    def name(self):
+        return '%s/%s' % (self.method, '-'.join(str(arg) for arg in self.args))
+
+def date_units(start, end, methods=DATED_METHODS):
+    "Yields a unit for each method and each date from start to end, inclusive"
+    day = start
+    while day <= end:
+        for method in methods:
+            yield CrawlUnit(method, (day.year, day.month, day.day))
+        day += datetime.timedelta(days=1)
+
+def committee_units(cmte_ids, methods=COMMITTEE_METHODS):
+    "Yields a unit for each method and each committee"
+    for cmte_id in cmte_ids:
+        for method in methods:
+            yield CrawlUnit(method, (cmte_id,))
+
+# Each worker process's clients, by API key
+_crawl_clients = {}
+
+def _crawl_unit(task):
+    unit, apikey, bucket, path, options = task
+    client = _crawl_clients.get(apikey)
+    if client is None:
+        limiter = RateLimiter(options['rate'], path=bucket)
+        client = _crawl_clients[apikey] = NytCampfin(
+            apikey, transport=Transport(limiter=limiter), cache=False,
+            base_uri=options['base_uri'])
+    namespace, name = unit.method.split('.')
+    method = getattr(getattr(client, namespace), name)
+    output = os.path.join(path, unit.name + '.ndjson')
+    try:
+        if not os.path.isdir(os.path.dirname(output)):
+            os.makedirs(os.path.dirname(output))
+    except OSError: # another worker got there first
+        pass
+    try:
+        return unit, export(method, output, *unit.args, cycle=options['cycle'], resume=True), None
+    except (NytCampfinError, EnvironmentError) as e:
+        # requests' connection errors and timeouts are EnvironmentErrors too;
+        # they fail this unit, to be retried on the next run, not the crawl
+        return unit, 0, str(e) or repr(e)
+
+class Crawl(object):
+    """
+    Backfills many units of work across a pool of processes and API keys
+
+        >>> units = list(date_units(datetime.date(2012, 1, 1), datetime.date(2012, 6, 30)))
+        >>> units += committee_units(['C00490045', 'C00431445'])
+        >>> crawl = Crawl('backfill', [KEY_1, KEY_2], units, processes=8)
+        >>> crawl.run(progress=print)
+
+    Each CrawlUnit is exported, page by page, to path/<method>/<args>.ndjson,
+    for cycle (CURRENT_CYCLE, as it is when the crawl runs, by default).
+    Units are dealt out to the keys in turn, and each key gets a
+    RateLimiter of `rate` requests a second shared by every process.
+
+    Finished units are appended to path/done.log; running the same crawl
+    again skips them and resumes any half-written unit from its export
+    checkpoint. Units that fail are left out of the log, with their
+    errors in the errors attribute, so a rerun retries them.
+
+    run() returns, and passes progress after each unit, a dict of unit and
+    record counts and throughput so far.
+    """
+
+    def __init__(self, path, apikeys, units, processes=None, cycle=None,
+                 rate=5, base_uri=None):
+        if isinstance(apikeys, string_types):
+            apikeys = [apikeys]
+        self.path = path
+        self.apikeys = list(apikeys)
+        self.units = list(OrderedDict.fromkeys(units))
+        self.processes = processes or 2 * len(self.apikeys)
+        self.cycle = cycle
+        self.rate = rate
+        self.base_uri = base_uri
+        self.errors = {}
+
+    @property
+    def log(self):
+        return os.path.join(self.path, 'done.log')
+
+    def done(self):
+        "Returns the names of the units finished so far"
+        if not os.path.exists(self.log):
+            return set()
+        with open(self.log) as f:
+            return set(line.strip() for line in f if line.strip())
+
+    def pending(self):
+        done = self.done()
+        return [unit for unit in self.units if unit.name not in done]
+
+    def run(self, progress=None):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        pending = self.pending()
+        # resolved here, not in the workers, so they all agree on the default
+        options = {'cycle': self.cycle or CURRENT_CYCLE, 'rate': self.rate,
+                   'base_uri': self.base_uri}
+        tasks = [(unit, self.apikeys[i % len(self.apikeys)],
+                  os.path.join(self.path, 'key-%s.bucket' % (i % len(self.apikeys))),
+                  self.path, options)
+                 for i, unit in enumerate(pending)]
+        stats = {'units': len(self.units), 'done': len(self.units) - len(pending),
+                 'failed': 0, 'records': 0, 'elapsed': 0.0,
+                 'units_per_s': 0.0, 'records_per_s': 0.0}
+        self.errors = {}
+        if not tasks:
+            return stats
+
+        start, finished = time.time(), 0
+        import multiprocessing
+        pool = multiprocessing.Pool(min(self.processes, len(tasks)))
+        try:
+            with open(self.log, 'a') as log:
+                for unit, records, error in pool.imap_unordered(_crawl_unit, tasks):
+                    if error is None:
+                        log.write(unit.name + '\n')
+                        log.flush()
+                        os.fsync(log.fileno())
+                        stats['done'] += 1
+                        stats['records'] += records
+                    else:
+                        self.errors[unit.name] = error
+                        stats['failed'] += 1
+                    finished += 1
+                    elapsed = time.time() - start
+                    stats.update(elapsed=elapsed, units_per_s=finished / elapsed,
+                                 records_per_s=stats['records'] / elapsed)
+                    if progress:
+                        progress(dict(stats))
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+        return stats
+
+# Command line
+
+def main(argv=None):
+    "python -m nytcampfin export committees.contributions C00381277 -o contribs.csv.gz"
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m nytcampfin',
+                                     description="NYT Campaign Finance API client")
+    commands = parser.add_subparsers(dest='command')
+    parser_export = commands.add_parser('export', help="stream a list endpoint to a file")
+    parser_export.add_argument('method', help="a client method, like committees.contributions")
+    parser_export.add_argument('args', nargs='*', help="the method's arguments")
+    parser_export.add_argument('-o', '--output', required=True,
+                               help="file to write; .csv, .ndjson and .gz pick the format")
+    parser_export.add_argument('--format', choices=('ndjson', 'csv'))
+    parser_export.add_argument('--gzip', action='store_true', default=None)
+    parser_export.add_argument('--cycle', type=int)
+    parser_export.add_argument('--resume', action='store_true',
+                               help="continue from the output's checkpoint")
+    parser_export.add_argument('--apikey', default=os.environ.get('NYT_CAMPFIN_API_KEY'))
+    parser_export.add_argument('--base-uri')
+
+    parser_crawl = commands.add_parser('crawl', help="backfill dates and committees into a directory")
+    parser_crawl.add_argument('path', help="directory for the records and progress")
+    parser_crawl.add_argument('--dates', nargs=2, metavar=('FROM', 'TO'),
+                              help="walk every date in this range, as YYYY-MM-DD")
+    parser_crawl.add_argument('--committees', nargs='+', default=(), metavar='ID',
+                              help="walk these committees' filings and contributions")
+    parser_crawl.add_argument('--apikey', action='append', dest='apikeys',
+                              help="an API key; repeat to spread the crawl over several")
+    parser_crawl.add_argument('--processes', type=int)
+    parser_crawl.add_argument('--rate', type=float, default=5,
+                              help="requests per second for each key")
+    parser_crawl.add_argument('--cycle', type=int)
+    parser_crawl.add_argument('--base-uri')
+    options = parser.parse_args(argv)
+    if options.command == 'crawl':
+        return _crawl_command(parser, options)
+    if options.command != 'export':
+        parser.error("choose a command")
+
+    finance = NytCampfin(options.apikey, cache=False, base_uri=options.base_uri,
+                         cycle=options.cycle)
+    try:
+        namespace, name = options.method.split('.')
+        method = getattr(getattr(finance, namespace), name)
+    except (ValueError, AttributeError):
+        parser.error("unknown method %s" % options.method)
+    count = export(method, options.output, *options.args, cycle=finance.cycle,
+                   format=options.format, compress=options.gzip, resume=options.resume)
+    print("%s records in %s" % (count, options.output))
+    return 0
+
+def _crawl_command(parser, options):
+    units = []
+    if options.dates:
+        try:
+            start, end = [datetime.datetime.strptime(d, '%Y-%m-%d').date() for d in options.dates]
+        except ValueError:
+            parser.error("dates must be YYYY-MM-DD")
+        units.extend(date_units(start, end))
+    units.extend(committee_units(options.committees))
+    apikeys = options.apikeys or [os.environ.get('NYT_CAMPFIN_API_KEY')]
+    crawl = Crawl(options.path, apikeys, units, processes=options.processes,
+                  cycle=options.cycle, rate=options.rate, base_uri=options.base_uri)
+
+    def report(stats):
+        sys.stderr.write("\r%(done)s/%(units)s units, %(failed)s failed, %(records)s records, "
+                         "%(units_per_s).1f units/s, %(records_per_s).0f records/s" % stats)
+    crawl.run(progress=report)
+    sys.stderr.write("\n")
+    for name, error in sorted(crawl.errors.items()):
+        sys.stderr.write("%s: %s\n" % (name, error))
+    return 1 if crawl.errors else 0
 
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,362 @@
+"""
+An asyncio client for the New York Times Campaign Finance API
+
+Mirrors the namespaced interface of nytcampfin.NytCampfin, but every
+method is a coroutine. Requires Python 3.6+ and aiohttp.
+"""
+import asyncio
+
+import aiohttp
+
+import nytcampfin
+from nytcampfin import (CONCURRENCY, PAGE_SIZE, BatchResult, Columns,
+                        NytCampfinError, NytNotFoundError, RequestEvent,
+                        _backoff, _clock, _quota, _throttled, _SubClient,
+                        _Evicted)
+
+__all__ = ('AsyncNytCampfin', 'AsyncTransport', 'AsyncSingleFlight',
+           'NytCampfinError', 'NytNotFoundError', 'collect')
+
+
+class AsyncTransport(object):
+    """
+    A pooled aiohttp session shared by an AsyncNytCampfin instance and all
+    of its sub-clients
+
+    The session is opened on first use, inside the running event loop.
+    limit caps the number of open connections and timeout applies to
+    every request, in seconds. limiter, retries, backoff and max_backoff
+    work as in nytcampfin.Transport, except that waits don't block the
+    event loop, and so do stats() and headroom().
+    """
+
+    def __init__(self, limit=10, timeout=30, limiter=None, retries=3,
+                 backoff=0.5, max_backoff=30):
+        self.limit = limit
+        self.timeout = timeout
+        self.limiter = limiter
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.quota = {}
+        self.requests = 0
+        self.retried = 0
+        self.connections = 0
+        self.session = None
+
+    async def _connected(self, session, context, params):
+        self.connections += 1
+
+    async def get(self, url, params=None, headers=None):
+        """
+        Returns the status code, raw body and headers of a GET request, and
+        the number of throttled attempts that were retried
+        """
+        if self.session is None:
+            tracing = aiohttp.TraceConfig()
+            tracing.on_connection_create_end.append(self._connected)
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                trace_configs=[tracing])
+        attempt = 0
+        while True:
+            if self.limiter:
+                wait = self.limiter.try_acquire()
+                while wait > 0:
+                    await asyncio.sleep(wait)
+                    wait = self.limiter.try_acquire()
+            self.requests += 1
+            async with self.session.get(url, params=params, headers=headers) as resp:
+                body = await resp.read()
+                status, resp_headers = resp.status, resp.headers
+            self.quota.update(_quota(resp_headers))
+            wait = None
+            if attempt < self.retries and _throttled(status, resp_headers):
+                wait = _backoff(attempt, resp_headers, self.backoff, self.max_backoff)
+            if wait is None:
+                return status, body, resp_headers, attempt
+            await asyncio.sleep(wait)
+            attempt += 1
+            self.retried += 1
+
+    # counters and quota are kept as in Transport, so these read them alike
+    stats = nytcampfin.Transport.stats
+    headroom = nytcampfin.Transport.headroom
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class AsyncSingleFlight(object):
+    """
+    Collapses concurrent identical fetches into one, like
+    nytcampfin.SingleFlight, for coroutines on one event loop
+
+    A fetch is cancelled once every caller waiting on it has been.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}
+
+    async def do(self, key, func, *args):
+        call = self._calls.get(key)
+        if call is None:
+            call = self._calls[key] = [asyncio.ensure_future(func(*args)), 0]
+            call[0].add_done_callback(lambda task: self._calls.pop(key, None))
+        else:
+            self.coalesced += 1
+        task = call[0]
+        call[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            call[1] -= 1
+            if not call[1]:
+                task.cancel() # only does anything if every caller was cancelled
+
+
+class AsyncClient(nytcampfin.Client):
+    """
+    Base class for the asyncio clients
+
+    Endpoint methods are inherited from the synchronous clients, so path
+    templates and error handling are shared; only fetch is awaitable here.
+    Settings are those of nytcampfin.Client, except that the transport is
+    an AsyncTransport and inflight an AsyncSingleFlight by default.
+    """
+
+    def __init__(self, apikey, transport=None, concurrency=CONCURRENCY,
+                 cache=None, ttls=None, validators=None, inflight=None,
+                 decoder=None, typed=False, base_uri=None, hooks=None,
+                 cycle=None):
+        super(AsyncClient, self).__init__(
+            apikey, transport or AsyncTransport(), concurrency, cache, ttls,
+            validators, AsyncSingleFlight() if inflight is None else inflight,
+            decoder, typed, base_uri, hooks, cycle)
+
+    async def fetch(self, path, *args, **kwargs):
+        args = self._with_cycle(args)
+        url, params, parse = self._prepare(path, args, kwargs)
+        key = self._cache_key(url, params)
+        event = RequestEvent(path, url, args) if self.hooks else None
+        if event is not None:
+            self._call_hooks('before_request', event)
+        start = _clock()
+        try:
+            body = self.cache.get(key) if self.cache else None
+            if body is None:
+                if event is not None:
+                    event.cache = 'miss'
+                if self.inflight:
+                    result = await self.inflight.do(key, self._load, key, url, params,
+                                                    path, args, event)
+                else:
+                    result = await self._load(key, url, params, path, args, event)
+                if event is not None and event.network is None:
+                    event.cache = 'coalesced'
+            else:
+                if event is not None:
+                    event.cache = 'hit'
+                    event.bytes = len(body)
+                started = _clock()
+                result = self._decode(body)
+                if event is not None:
+                    event.decode = _clock() - started
+            started = _clock()
+            result = self._parse(result, parse, url, path)
+            if event is not None:
+                event.parse = _clock() - started
+            return result
+        except Exception as e:
+            if event is not None:
+                event.error = e
+            raise
+        finally:
+            if event is not None:
+                event.elapsed = _clock() - start
+                self._call_hooks('after_request', event)
+
+    async def _load(self, key, url, params, path, args, event=None, conditional=True):
+        "Fetches, decodes and caches a response from the network"
+        started = _clock()
+        status, body, headers, retries = await self.transport.get(
+            url, params=params,
+            headers=self._conditional_headers(key) if conditional else None)
+        if event is not None:
+            event.network = _clock() - started
+            event.status = status
+            event.bytes = len(body)
+            event.retries = retries
+        try:
+            return self._handle(key, path, args, status, body, headers, event)
+        except _Evicted:
+            return await self._load(key, url, params, path, args, event,
+                                    conditional=False)
+
+    async def to_columns(self, method, *args, **kwargs):
+        """
+        Streams every record from an offset-based list method into Columns,
+        as nytcampfin.Client.to_columns does, awaiting each page
+        """
+        columns = Columns(kwargs.pop('fields', None), kwargs.pop('numeric', None))
+        stream = self.bulk if kwargs.pop('bulk', False) else self.paginate
+        async for record in stream(method, *args, **kwargs):
+            columns.extend([record])
+        return columns
+
+    async def paginate(self, method, *args, **kwargs):
+        """
+        Asynchronously yields every record from an offset-based list method,
+        one page at a time, stopping after the first short page.
+
+            >>> async for filing in finance.paginate(finance.filings.date, 2012, 7, 4):
+            ...     print(filing['filing_id'])
+        """
+        page_size = kwargs.pop('page_size', PAGE_SIZE)
+        offset = kwargs.pop('offset', 0) or 0
+        while True:
+            page = await method(*args, offset=offset, **kwargs)
+            for record in page:
+                yield record
+            if len(page) < page_size:
+                return
+            offset += page_size
+
+    async def bulk(self, method, *args, **kwargs):
+        """
+        Like paginate, but keeps up to `concurrency` pages in flight at once.
+        Records are yielded in page order.
+        """
+        concurrency = max(min(kwargs.pop('concurrency', None) or self.concurrency,
+                              self.concurrency), 1)
+        page_size = kwargs.pop('page_size', PAGE_SIZE)
+        offset = kwargs.pop('offset', 0) or 0
+
+        def fetch_page(offset):
+            return asyncio.ensure_future(method(*args, offset=offset, **kwargs))
+
+        pending = []
+        try:
+            for i in range(concurrency):
+                pending.append(fetch_page(offset))
+                offset += page_size
+            while pending:
+                page = await pending.pop(0)
+                if len(page) >= page_size:
+                    pending.append(fetch_page(offset))
+                    offset += page_size
+                for record in page:
+                    yield record
+                if len(page) < page_size:
+                    return
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _batch(self, method, path, calls, concurrency=None):
+        semaphore = asyncio.Semaphore(max(min(concurrency or self.concurrency,
+                                              self.concurrency), 1))
+
+        async def lookup(id, cycle):
+            async with semaphore:
+                try:
+                    return await method(id, cycle), None
+                except NytNotFoundError as e:
+                    return None, e
+
+        found = await asyncio.gather(*[lookup(id, cycle) for key, id, cycle in calls])
+        results = BatchResult()
+        for (key, id, cycle), (record, error) in zip(calls, found):
+            if error is not None:
+                results.errors[key] = error
+            else:
+                results[key] = record
+        return results
+
+
+class AsyncFilingsClient(AsyncClient, nytcampfin.FilingsClient):
+    pass
+
+class AsyncIndependentExpenditureClient(AsyncClient, nytcampfin.IndependentExpenditureClient):
+    pass
+
+class AsyncCandidatesClient(AsyncClient, nytcampfin.CandidatesClient):
+    pass
+
+class AsyncCommitteesClient(AsyncClient, nytcampfin.CommitteesClient):
+    pass
+
+class AsyncPresidentClient(AsyncClient, nytcampfin.PresidentClient):
+    pass
+
+class AsyncLateContributionClient(AsyncClient, nytcampfin.LateContributionClient):
+    pass
+
+
+class AsyncNytCampfin(AsyncClient):
+    """
+    Implements the public interface for the NYT Campaign Finance API
+    on top of asyncio
+
+    The namespaces match NytCampfin, and every method must be awaited:
+
+        >>> async with AsyncNytCampfin(apikey) as finance:
+        ...     today = await finance.filings.today()
+        ...     cmte = await finance.committees.get('C00490219')
+
+    All sub-clients share one AsyncTransport and one cache, which works as
+    in NytCampfin; close the client when done, or use it as an async
+    context manager.
+    """
+
+    filings = _SubClient('filings', AsyncFilingsClient)
+    committees = _SubClient('committees', AsyncCommitteesClient)
+    candidates = _SubClient('candidates', AsyncCandidatesClient)
+    president = _SubClient('president', AsyncPresidentClient)
+    indexp = _SubClient('indexp', AsyncIndependentExpenditureClient)
+    late_contribs = _SubClient('late_contribs', AsyncLateContributionClient)
+
+    def __init__(self, apikey, transport=None, concurrency=CONCURRENCY,
+                 cache=None, ttls=None, validators=None, inflight=None,
+                 decoder=None, typed=False, base_uri=None, hooks=None,
+                 cycle=None):
+        super(AsyncNytCampfin, self).__init__(apikey, transport, concurrency,
+                                              cache, ttls, validators, inflight,
+                                              decoder, typed, base_uri, hooks,
+                                              cycle)
+
+    def _subclient(self, cls):
+        "Builds a sub-client that shares this client's settings"
+        return cls(self.apikey, transport=self.transport,
+                   concurrency=self.concurrency, cache=self.cache,
+                   ttls=self.ttls, validators=self.validators,
+                   inflight=self.inflight, decoder=self.decoder,
+                   typed=self.typed, base_uri=self.BASE_URI,
+                   hooks=self.hooks, cycle=self.cycle)
+
+    async def close(self):
+        await self.transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+def collect(loop, records):
+    """
+    Runs loop until the async generator records is exhausted and returns
+    what it yielded as a list, for synchronous callers such as tests and
+    benchmarks
+
+        >>> loop = asyncio.new_event_loop()
+        >>> contribs = collect(loop, finance.paginate(finance.committees.contributions, 'C00381277'))
+    """
+    async def drain():
+        return [record async for record in records]
+    return loop.run_until_complete(drain())
@@ -0,0 +1,231 @@
+"""
+A local stand-in for the New York Times Campaign Finance API
+
+Serves every endpoint nytcampfin knows about with pages of fake records,
+so tests and benchmarks can run without the network or an API key:
+
+    $ python -m nytcampfin_stub --port 8000 --delay 0.05
+
+    >>> finance = NytCampfin('any-key', base_uri='http://127.0.0.1:8000')
+
+or from Python:
+
+    >>> server = StubServer(delay=0.05).start()
+    >>> finance = NytCampfin('any-key', base_uri=server.base_uri)
+    >>> server.stop()
+
+Every list endpoint holds `total` records of the form {'id', 'path'},
+served `page_size` at a time by offset. IDs containing "missing" get a
+404, as do paths that aren't API endpoints, and paths containing the
+server's `garbled` string get a 200 with an HTML page instead of JSON.
+"""
+import re
+import sys
+import json
+import time
+import random
+import socket
+import hashlib
+import argparse
+import threading
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+import nytcampfin
+
+__all__ = ('StubServer', 'ENDPOINTS')
+
+# Path templates of every endpoint the clients call
+ENDPOINTS = (
+    "/%s/filings",
+    "/%s/filings/%s/%s/%s",
+    "/%s/filings/types",
+    "/%s/filings/types/%s",
+    "/%s/filings/amendments",
+    "/%s/independent_expenditures",
+    "/%s/independent_expenditures/%s/%s/%s",
+    "/%s/independent_expenditures/race_totals/%s",
+    "/%s/committees/%s/independent_expenditures",
+    "/%s/committees/%s/independent_expenditures/races",
+    "/%s/candidates/%s/independent_expenditures",
+    "/%s/president/independent_expenditures",
+    "/%s/committees/superpacs",
+    "/%s/candidates/new",
+    "/%s/candidates/search",
+    "/%s/candidates/leaders/%s",
+    "/%s/candidates/%s",
+    "/%s/candidates/%s/48hour",
+    "/%s/seats/%s",
+    "/%s/seats/%s/%s",
+    "/%s/seats/%s/%s/%s",
+    "/%s/committees/new",
+    "/%s/committees/search",
+    "/%s/committees/leadership",
+    "/%s/committees/%s",
+    "/%s/committees/%s/48hour",
+    "/%s/committees/%s/filings",
+    "/%s/committees/%s/contributions",
+    "/%s/committees/%s/contributions/candidates/%s",
+    "/%s/president/totals",
+    "/%s/president/candidates/%s",
+    "/%s/president/states/%s",
+    "/%s/president/zips/%s",
+    "/%s/contributions/48hour",
+    "/%s/contributions/48hour/%s/%s/%s",
+)
+
+# Paths may carry the live API's prefix, so base_uri can be either
+# http://host:port or http://host:port/svc/elections/us/v3/finances
+_PREFIX = urlparse(nytcampfin.Client.BASE_URI).path
+
+_ROUTES = re.compile(r'^(?:%s)?(?:%s)\.json$' % (
+    re.escape(_PREFIX),
+    '|'.join(re.escape(e).replace(re.escape('%s'), '[^/]+') for e in ENDPOINTS)))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    "Answers API requests from the options of its StubServer"
+
+    protocol_version = 'HTTP/1.1'
+
+    # headers and body go out in separate writes; with Nagle on, keep-alive
+    # clients wait out a delayed ACK on every response
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(server.delay + random.uniform(0, server.jitter))
+        url = urlparse(self.path)
+        offset = int(parse_qs(url.query).get('offset', ['0'])[0])
+        headers = {}
+        if server.throttled():
+            status, body = 429, {'status': 'ERROR', 'errors': ['Rate limit exceeded']}
+            if server.retry_after is not None:
+                headers['Retry-After'] = str(server.retry_after)
+        elif not _ROUTES.match(url.path):
+            status, body = 404, {'status': 'ERROR', 'errors': ['Unknown endpoint']}
+        elif 'missing' in url.path:
+            status, body = 404, {'status': 'ERROR', 'errors': ['Record not found']}
+        elif server.garbled and server.garbled in url.path:
+            status, body = 200, None
+        else:
+            count = max(0, min(server.page_size, server.total - offset))
+            results = [server.record(offset + i, url.path) for i in range(count)]
+            status, body = 200, {'status': 'OK', 'num_results': len(results), 'results': results}
+        if body is None:
+            content_type, body = 'text/html', b'<html><body>Down for maintenance</body></html>'
+        else:
+            content_type, body = 'application/json', json.dumps(body).encode('utf-8')
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            status, body = 304, b''
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('X-RateLimit-Limit-day', '5000')
+        self.send_header('X-RateLimit-Remaining-day', '4999')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """
+    A threaded HTTP server that plays the API
+
+    total and page_size shape every list endpoint. Each response waits
+    delay seconds plus up to jitter more, to simulate network latency.
+    The next `throttle` requests are answered with a 429, carrying a
+    Retry-After of `retry_after` seconds if that is set. padding adds a
+    string of that many bytes to each record, for heavier payloads.
+    Paths containing `garbled`, if set, are answered with an HTML page.
+    All of these can be changed while the server is running.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0), total=45,
+                 page_size=nytcampfin.PAGE_SIZE, delay=0, jitter=0,
+                 throttle=0, padding=0, retry_after=None, garbled=None):
+        HTTPServer.__init__(self, address, StubHandler)
+        self.total = total
+        self.page_size = page_size
+        self.delay = delay
+        self.jitter = jitter
+        self.throttle = throttle
+        self.padding = padding
+        self.retry_after = retry_after
+        self.garbled = garbled
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_uri(self):
+        return "http://%s:%s" % self.server_address[:2]
+
+    def record(self, id, path):
+        record = {'id': id, 'path': path}
+        if self.padding:
+            record['padding'] = 'x' * self.padding
+        return record
+
+    def throttled(self):
+        with self._lock:
+            if self.throttle > 0:
+                self.throttle -= 1
+                return True
+            return False
+
+    def handle_error(self, request, client_address):
+        # clients that stop paging early hang up on responses in flight
+        if not isinstance(sys.exc_info()[1], socket.error):
+            HTTPServer.handle_error(self, request, client_address)
+
+    def start(self):
+        "Serves from a background thread; returns the server"
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--total', type=int, default=45,
+                        help="records in every list endpoint")
+    parser.add_argument('--delay', type=float, default=0,
+                        help="seconds to wait before each response")
+    parser.add_argument('--jitter', type=float, default=0,
+                        help="up to this many more seconds, at random")
+    parser.add_argument('--padding', type=int, default=0,
+                        help="extra bytes per record")
+    args = parser.parse_args(argv)
+    server = StubServer((args.host, args.port), total=args.total, delay=args.delay,
+                        jitter=args.jitter, padding=args.padding)
+    print("Serving the campaign finance API at %s" % server.base_uri)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == '__main__':
+    sys.exit(main())
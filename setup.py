@@ -12,7 +12,7 @@ setup(
     long_description = README,
     author = "Derek Willis",
     author_email = "dwillis@gmail.com",
-    py_modules = ['nytcampfin'],
+    py_modules = ['nytcampfin', 'nytcampfin_async', 'nytcampfin_stub'],
     platforms=["any"],
     classifiers=[
                  "Intended Audience :: Developers",
@@ -1,28 +1,89 @@
 import os
+import json
+import time
+import datetime
+import threading
 import unittest
-import requests
-import requests_cache
+import shutil
+import socket
+import tempfile
+import csv
+import gzip
+import subprocess
+import sys
 
-from nytcampfin import NytCampfin, NytCampfinError, NytNotFoundError
+from nytcampfin import (NytCampfin, NytCampfinError, NytNotFoundError,
+                        MemoryCache, SqliteCache, DirectoryCache, Watcher,
+                        RateLimiter, Transport, LazyRecords, lazy_loads,
+                        Filing, IndependentExpenditure, Columns, Mirror,
+                        FixtureTransport, Metrics, export, Crawl, date_units,
+                        committee_units, WarmStart, FixtureResponse)
+from nytcampfin_stub import StubServer
+import nytcampfin
 
-CURRENT_CYCLE = 2012
 try:
-    API_KEY = os.environ['NYT_CAMPFIN_API_KEY']
-except:
-    print "Please set your API Key as an environment variable"
-    
+    import asyncio
+    from nytcampfin_async import AsyncNytCampfin, AsyncTransport, collect
+except (ImportError, SyntaxError):
+    AsyncNytCampfin = None
+
+CURRENT_CYCLE = 2012
+
+# The API tests run against the live API when NYT_CAMPFIN_API_KEY is set,
+# and against the bundled stub otherwise. With NYT_CAMPFIN_FIXTURES set to
+# a directory, responses are replayed from it instead, recording any that
+# are missing when there is a key.
+API_KEY = os.environ.get('NYT_CAMPFIN_API_KEY')
+FIXTURES = os.environ.get('NYT_CAMPFIN_FIXTURES')
+LIVE_BASE_URI = NytCampfin.BASE_URI
+
+STUB_TOTAL = 45
+
+# Subprocesses run from here so they import this checkout of nytcampfin
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+class StubTest(unittest.TestCase):
+    "Runs against a local stub of the API instead of api.nytimes.com"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubServer(total=STUB_TOTAL).start()
+        cls.base_uri = cls.server.base_uri
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
 
-class APITest(unittest.TestCase):
+    def point_at_stub(self, finance):
+        for client in (finance, finance.filings, finance.committees, finance.candidates,
+                       finance.president, finance.indexp, finance.late_contribs):
+            client.BASE_URI = self.base_uri
+        return finance
+
+class TempDirTest(unittest.TestCase):
+    "Gives each test a scratch directory, self.tmpdir, removed afterwards"
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+class APITest(StubTest):
     
     def check_response(self, result, url, parse=lambda r: r['results']):
-        with requests_cache.disabled(): # test requests should not be cached
-            response = requests.get(url)
-            if parse and callable(parse):
-                response = parse(response.json)
-            self.assertEqual(result, response)
+        url = url.replace(LIVE_BASE_URI, self.finance.BASE_URI)
+        response = self.finance.transport.get(url) # bypasses the client's cache
+        if parse and callable(parse):
+            response = parse(json.loads(response.content.decode('utf-8')))
+        self.assertEqual(result, response)
     
     def setUp(self):
-        self.finance = NytCampfin(API_KEY)
+        if FIXTURES:
+            transport = FixtureTransport(FIXTURES, 'once' if API_KEY else 'replay')
+            self.finance = NytCampfin(API_KEY or 'fixture-key', transport=transport)
+        elif API_KEY:
+            self.finance = NytCampfin(API_KEY)
+        else:
+            self.finance = NytCampfin('stub-key', base_uri=self.base_uri)
     
 class FilingTest(APITest):
 
@@ -32,8 +93,8 @@ class FilingTest(APITest):
         self.check_response(today, url)
         
     def test_filings_for_date(self):
-        july4th = self.finance.filings.date(2012,07,04)
-        url = "http://api.nytimes.com/svc/elections/us/v3/finances/2012/filings/2012/07/04.json?api-key=%s" % API_KEY
+        july4th = self.finance.filings.date(2012,7,4)
+        url = "http://api.nytimes.com/svc/elections/us/v3/finances/2012/filings/2012/7/4.json?api-key=%s" % API_KEY
         self.check_response(july4th, url)
     
     def test_form_types(self):
@@ -43,7 +104,7 @@ class FilingTest(APITest):
         
     def test_filings_by_form_type(self):
         f2s = self.finance.filings.by_type('F2')
-        url = "http://api.nytimes.com/svc/elections/us/v3/finances/2012/filings/types/f2.json?api-key=%s" % API_KEY
+        url = "http://api.nytimes.com/svc/elections/us/v3/finances/2012/filings/types/F2.json?api-key=%s" % API_KEY
         self.check_response(f2s, url)
     
     def test_amended_filings(self):
@@ -51,6 +112,59 @@ class FilingTest(APITest):
         url = "http://api.nytimes.com/svc/elections/us/v3/finances/2012/filings/amendments.json?api-key=%s" % API_KEY
         self.check_response(amendments, url)
 
+class PaginationTest(APITest):
+
+    def test_paginate(self):
+        contributions = list(self.finance.paginate(self.finance.committees.contributions, "C00381277"))
+        first_page = self.finance.committees.contributions("C00381277")
+        self.assertEqual(contributions[:len(first_page)], first_page)
+        self.assertTrue(len(contributions) >= len(first_page))
+
+    def test_paginate_with_prefetch(self):
+        method = self.finance.committees.contributions
+        self.assertEqual(list(self.finance.paginate(method, "C00381277", prefetch=True)),
+                         list(self.finance.paginate(method, "C00381277")))
+
+    def test_bulk(self):
+        method = self.finance.committees.contributions
+        self.assertEqual(list(self.finance.bulk(method, "C00381277", concurrency=3)),
+                         list(self.finance.paginate(method, "C00381277")))
+
+class TransportTest(APITest):
+
+    def test_shared_transport(self):
+        for client in (self.finance.filings, self.finance.committees, self.finance.late_contribs):
+            self.assertTrue(client.transport is self.finance.transport)
+
+    @unittest.skipIf(FIXTURES, "fixtures are replayed without connections")
+    def test_connection_reuse(self):
+        self.finance.filings.form_types()
+        self.finance.filings.amendments()
+        stats = self.finance.transport.stats()
+        self.assertEqual(stats['requests'], 2)
+        self.assertTrue(stats['reused'] >= 1)
+
+class StartupTest(StubTest):
+
+    def test_import_is_light(self):
+        output = subprocess.check_output([sys.executable, '-c',
+            "import sys, nytcampfin; nytcampfin.NytCampfin('key');"
+            "print(' '.join(m for m in ('requests', 'numpy', 'sqlite3', 'multiprocessing.pool')"
+            " if m in sys.modules))"], cwd=HERE)
+        self.assertEqual(output.decode('utf-8').strip(), '')
+
+    def test_lazy_subclients(self):
+        finance = NytCampfin('key', base_uri=self.base_uri)
+        self.assertFalse('filings' in vars(finance))
+        self.assertTrue(finance.transport._session is None)
+        filings = finance.filings
+        self.assertTrue(finance.filings is filings)
+        self.assertTrue(filings.transport is finance.transport)
+        self.assertFalse('committees' in vars(finance))
+        self.assertEqual(finance.transport.stats()['connections'], 0)
+        self.assertEqual(len(filings.today()), 20)
+        self.assertEqual(finance.transport.stats()['requests'], 1)
+
 class IndependentExpenditureTest(APITest):
     
     def test_latest(self):
@@ -59,8 +173,8 @@ class IndependentExpenditureTest(APITest):
         self.check_response(latest, url)
     
     def test_ies_for_date(self):
-        july3rd = self.finance.indexp.date(2012,07,03)
-        url = "http://api.nytimes.com/svc/elections/us/v3/finances/2012/independent_expenditures/2012/07/03.json?api-key=%s" % API_KEY
+        july3rd = self.finance.indexp.date(2012,7,3)
+        url = "http://api.nytimes.com/svc/elections/us/v3/finances/2012/independent_expenditures/2012/7/3.json?api-key=%s" % API_KEY
         self.check_response(july3rd, url)
 
     def test_committee_ies(self):
@@ -99,7 +213,6 @@ class CandidateTest(APITest):
     def test_detail(self):
         detail = self.finance.candidates.get("H4NY11138")
         url = "http://api.nytimes.com/svc/elections/us/v3/finances/2012/candidates/H4NY11138.json?api-key=%s" % API_KEY
-        response = requests.get(url)
         self.check_response(detail, url, parse=lambda r: r['results'][0])
     
     def test_filter(self):
@@ -143,7 +256,6 @@ class CommitteeTest(APITest):
     def test_detail(self):
         detail = self.finance.committees.get("C00490045")
         url = "http://api.nytimes.com/svc/elections/us/v3/finances/2012/committees/C00490045.json?api-key=%s" % API_KEY
-        response = requests.get(url)
         self.check_response(detail, url, parse=lambda r: r['results'][0])
 
     def test_filter(self):
@@ -220,6 +332,793 @@ class PresidentTest(APITest):
         url = "http://api.nytimes.com/svc/elections/us/v3/finances/2012/president/zips/33407.json?api-key=%s" % API_KEY
         self.check_response(zipcode, url)
     
+@unittest.skipIf(AsyncNytCampfin is None, "asyncio and aiohttp are required")
+class AsyncTest(StubTest):
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.finance = self.point_at_stub(AsyncNytCampfin('stub-key'))
+
+    def tearDown(self):
+        self.run_async(self.finance.close())
+        self.loop.close()
+
+    def test_list_method(self):
+        filings = self.run_async(self.finance.filings.date(2012, 7, 4))
+        self.assertEqual(len(filings), 20)
+        self.assertEqual(filings[0]['path'], '/2012/filings/2012/7/4.json')
+
+    def test_single_result(self):
+        committee = self.run_async(self.finance.committees.get("C00490045", 2010))
+        self.assertEqual(committee, {'id': 0, 'path': '/2010/committees/C00490045.json'})
+
+    def test_positional_settings(self):
+        args = ('stub-key', None, 4, False, {}, None, None, None, True,
+                'http://localhost/', [], 2010)
+        sync, finance = NytCampfin(*args), AsyncNytCampfin(*args)
+        for name in ('concurrency', 'ttls', 'typed', 'BASE_URI', 'hooks', 'cycle'):
+            self.assertEqual(getattr(finance, name), getattr(sync, name))
+        self.run_async(finance.close())
+
+    def test_conditional_refetch(self):
+        finance = self.point_at_stub(AsyncNytCampfin('stub-key', cache=False))
+        first = self.run_async(finance.filings.today())
+        self.assertEqual(self.run_async(finance.filings.today()), first)
+        self.assertEqual(finance.validators.revalidated, 1)
+        self.run_async(finance.close())
+
+    def test_get_many(self):
+        committees = self.run_async(self.finance.committees.get_many(["C00490045", "missing"]))
+        self.assertEqual(list(committees.keys()), ["C00490045"])
+        self.assertEqual(list(committees.errors.keys()), ["missing"])
+
+    def test_get_cycles(self):
+        finance = self.point_at_stub(AsyncNytCampfin('stub-key', cycle=2010))
+        cands = self.run_async(finance.candidates.get_cycles("H4NY11138", [2008, 2012]))
+        self.assertEqual(cands[2008]['path'], '/2008/candidates/H4NY11138.json')
+        self.assertEqual(self.run_async(finance.filings.today())[0]['path'], '/2010/filings.json')
+        self.run_async(finance.close())
+
+    def test_not_found(self):
+        self.assertRaises(NytNotFoundError, self.run_async,
+                          self.finance.candidates.get("missing"))
+
+    def test_paginate(self):
+        async_list = collect(self.loop, self.finance.paginate(
+            self.finance.late_contribs.date, 2012, 3, 23))
+        self.assertEqual([r['id'] for r in async_list], list(range(STUB_TOTAL)))
+
+    def test_bulk(self):
+        async_list = collect(self.loop, self.finance.bulk(
+            self.finance.committees.contributions, "C00381277", concurrency=3))
+        self.assertEqual([r['id'] for r in async_list], list(range(STUB_TOTAL)))
+
+    def test_shared_settings(self):
+        events = []
+        finance = self.point_at_stub(AsyncNytCampfin('stub-key', hooks=[Metrics()]))
+        finance.hooks.append(type('Hook', (), {'after_request': lambda hook, event: events.append(event)})())
+        tasks = [self.loop.create_task(finance.committees.get("C00490045")) for i in range(3)]
+        self.run_async(asyncio.gather(*tasks))
+        self.run_async(finance.committees.get("C00490045"))
+        self.assertEqual(finance.transport.requests, 1)
+        self.assertEqual(finance.inflight.coalesced, 2)
+        self.assertEqual(sorted(event.cache for event in events),
+                         ['coalesced', 'coalesced', 'hit', 'miss'])
+        self.assertEqual(finance.hooks[0].report()['/%s/committees/%s']['calls'], 4)
+        self.run_async(finance.close())
+
+    def test_revalidation_and_retries(self):
+        events = []
+        finance = self.point_at_stub(AsyncNytCampfin(
+            'stub-key', cache=False, transport=AsyncTransport(backoff=0.01),
+            hooks=[type('Hook', (), {'after_request': lambda hook, event: events.append(event)})()]))
+        self.run_async(finance.filings.today())
+        self.server.throttle = 1
+        self.run_async(finance.filings.today())
+        self.assertEqual([e.cache for e in events], ['miss', 'revalidated'])
+        self.assertEqual([e.retries for e in events], [0, 1])
+        stats = finance.transport.stats()
+        self.assertEqual((stats['requests'], stats['retried']), (3, 1))
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(finance.transport.headroom(), {'day': 4999})
+        self.run_async(finance.close())
+
+    def test_to_columns(self):
+        columns = self.run_async(self.finance.to_columns(
+            self.finance.committees.contributions, "C00381277", numeric=['id']))
+        self.assertEqual(len(columns), STUB_TOTAL)
+        self.assertEqual(sum(columns['id']), sum(range(STUB_TOTAL)))
+
+class CacheTest(StubTest, TempDirTest):
+
+    def check_cache(self, cache):
+        finance = self.point_at_stub(NytCampfin('stub-key', cache=cache))
+        first = finance.committees.get("C00490045")
+        self.assertEqual(finance.committees.get("C00490045"), first)
+        self.assertEqual(finance.transport.requests, 1)
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'evictions': 0})
+
+    def test_memory_cache(self):
+        self.check_cache(MemoryCache())
+
+    def test_sqlite_cache(self):
+        self.check_cache(SqliteCache(os.path.join(self.tmpdir, 'cache.sqlite')))
+
+    def test_directory_cache(self):
+        self.check_cache(DirectoryCache(os.path.join(self.tmpdir, 'cache')))
+
+    def test_lru_eviction(self):
+        cache = MemoryCache(max_bytes=10)
+        cache.set('a', b'12345', 60)
+        cache.set('b', b'12345', 60)
+        cache.get('a')
+        cache.set('c', b'12345', 60)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), b'12345')
+        self.assertEqual(cache.evictions, 1)
+
+    def test_expiry(self):
+        cache = MemoryCache()
+        cache.set('a', b'12345', -1)
+        cache.set('b', b'12345', 60)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('b'), b'12345')
+
+    def test_per_endpoint_ttls(self):
+        finance = NytCampfin('stub-key', cache=False)
+        self.assertEqual(finance._ttl("/%s/filings", (2012,)), 10)
+        self.assertEqual(finance._ttl("/%s/filings/types", (2012,)), 24 * 60 * 60)
+        self.assertEqual(finance._ttl("/%s/president/states/%s", (2012, 'AZ')), 5 * 60)
+        self.assertEqual(finance._ttl("/%s/president/states/%s", (2008, 'AZ')), 30 * 24 * 60 * 60)
+        self.assertEqual(finance._ttl("/%s/contributions/48hour", (2008,)), 10)
+
+    def test_conditional_refetch(self):
+        finance = self.point_at_stub(NytCampfin('stub-key', cache=False))
+        first = finance.filings.today()
+        self.assertEqual(finance.filings.today(), first)
+        stats = finance.validators.stats()
+        self.assertEqual(stats['revalidated'], 1)
+        self.assertEqual(stats['parses_saved'], 1)
+        self.assertTrue(stats['bytes_saved'] > 0)
+
+    def test_not_modified_after_eviction(self):
+        finance = self.point_at_stub(NytCampfin('stub-key', cache=False))
+        first = finance.filings.today()
+        get = finance.transport.get
+
+        def evict_then_get(url, params=None, headers=None):
+            if headers:
+                finance.validators._entries.clear() # as other requests would
+            return get(url, params=params, headers=headers)
+        finance.transport.get = evict_then_get
+        self.assertEqual(finance.filings.today(), first)
+        self.assertEqual(finance.transport.requests, 3)
+        self.assertEqual(finance.validators.revalidated, 0)
+
+    def test_cache_disabled(self):
+        finance = self.point_at_stub(NytCampfin('stub-key', cache=False))
+        finance.filings.form_types()
+        finance.filings.form_types()
+        self.assertEqual(finance.transport.requests, 2)
+
+class WatcherTest(TempDirTest):
+
+    def setUp(self):
+        super(WatcherTest, self).setUp()
+        self.path = os.path.join(self.tmpdir, 'marks.json')
+        self.filings = [{'filing_id': i} for i in range(50, 0, -1)]
+        self.requests = 0
+
+    def feed(self, offset=0):
+        self.requests += 1
+        return self.filings[offset:offset + 20]
+
+    def poll(self, watcher):
+        return [f['filing_id'] for f in watcher.poll(self.feed, key=lambda f: f['filing_id'], name='test')]
+
+    def test_first_poll_yields_everything(self):
+        self.assertEqual(self.poll(Watcher(None, self.path)), list(range(50, 0, -1)))
+        self.assertEqual(self.requests, 3)
+
+    def test_only_new_records(self):
+        self.poll(Watcher(None, self.path))
+        self.filings[:0] = [{'filing_id': 52}, {'filing_id': 51}]
+        self.requests = 0
+        watcher = Watcher(None, self.path) # reloads the saved mark
+        self.assertEqual(self.poll(watcher), [52, 51])
+        self.assertEqual(self.requests, 1)
+        self.assertEqual(self.poll(watcher), [])
+
+    def test_mark_waits_for_complete_poll(self):
+        watcher = Watcher(None, self.path)
+        records = watcher.poll(self.feed, key=lambda f: f['filing_id'], name='test')
+        next(records)
+        records.close()
+        self.assertEqual(watcher.marks, {})
+
+    def test_method_feed_needs_a_name(self):
+        records = Watcher(None, self.path).poll(self.feed, key=lambda f: f['filing_id'])
+        self.assertRaises(ValueError, next, records)
+
+    def test_mark_holds_when_max_pages_stops_short(self):
+        self.poll(Watcher(None, self.path))
+        self.filings[:0] = [{'filing_id': i} for i in range(110, 50, -1)]
+        watcher = Watcher(None, self.path)
+        first = [f['filing_id'] for f in watcher.poll(self.feed, key=lambda f: f['filing_id'],
+                                                      name='test', max_pages=1)]
+        self.assertEqual(first, list(range(110, 90, -1)))
+        self.assertEqual(watcher.marks['test'], 50)
+        self.assertEqual(self.poll(watcher), list(range(110, 50, -1)))
+        self.assertEqual(watcher.marks['test'], 110)
+
+class CoalescingTest(StubTest):
+
+    def tearDown(self):
+        self.server.delay = 0
+
+    def test_identical_requests_coalesce(self):
+        self.server.delay = 0.3
+        finance = self.point_at_stub(NytCampfin('stub-key', cache=False))
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(finance.candidates.get("H4NY11138")))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 8)
+        self.assertEqual(finance.transport.requests, 1)
+        self.assertEqual(finance.inflight.coalesced, 7)
+
+    def test_errors_are_shared(self):
+        self.server.delay = 0.3
+        finance = self.point_at_stub(NytCampfin('stub-key', cache=False))
+        errors = []
+
+        def get():
+            try:
+                finance.candidates.get("missing")
+            except NytNotFoundError as e:
+                errors.append(e)
+        threads = [threading.Thread(target=get) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 8)
+        self.assertEqual(finance.transport.requests, 1)
+        self.assertEqual(finance.inflight.coalesced, 7)
+        self.assertEqual(finance.inflight._calls, {})
+
+class CycleTest(StubTest):
+
+    def test_get_cycles(self):
+        finance = self.point_at_stub(NytCampfin('stub-key'))
+        cmtes = finance.committees.get_cycles("C00490045", [2008, 2012, 2008, 2010])
+        self.assertEqual(sorted(cmtes), [2008, 2010, 2012])
+        self.assertEqual(cmtes[2010]['path'], '/2010/committees/C00490045.json')
+        self.assertEqual(list(finance.president.detail_cycles("missing", [2008]).errors), [2008])
+        requests = finance.transport.requests
+        finance.candidates.get_cycles("H4NY11138", [2008, 2012])
+        finance.candidates.get_cycles("H4NY11138", [2012, 2008])
+        self.assertEqual(finance.transport.requests, requests + 2)
+
+    def test_default_cycle(self):
+        finance = self.point_at_stub(NytCampfin('stub-key', cycle=2016))
+        self.assertEqual(finance.filings.today()[0]['path'], '/2016/filings.json')
+        self.assertEqual(finance.committees.get_many(["C00490045"])["C00490045"]['path'],
+                         '/2016/committees/C00490045.json')
+        self.assertEqual(finance.committees.get("C00490045", 2012)['path'],
+                         '/2012/committees/C00490045.json')
+
+    def test_closed_cycles_cached_longer(self):
+        finance = NytCampfin('stub-key', cycle=2016)
+        self.assertEqual(finance._ttl("/%s/committees/%s", (2012, "C00490045")),
+                         nytcampfin.CLOSED_CYCLE_TTL)
+        self.assertEqual(finance._ttl("/%s/committees/%s", (2016, "C00490045")),
+                         nytcampfin.DEFAULT_TTL)
+
+class BatchTest(StubTest):
+
+    def setUp(self):
+        self.finance = self.point_at_stub(NytCampfin('stub-key'))
+
+    def test_get_many(self):
+        committees = self.finance.committees.get_many(["C00490045", "missing", "C00381277", "C00490045"])
+        self.assertEqual(sorted(committees.keys()), ["C00381277", "C00490045"])
+        self.assertEqual(committees["C00381277"], self.finance.committees.get("C00381277"))
+        self.assertEqual(list(committees.errors.keys()), ["missing"])
+        self.assertTrue(isinstance(committees.errors["missing"], NytNotFoundError))
+        self.assertEqual(self.finance.transport.requests, 3)
+
+    def test_cached_ids_are_not_refetched(self):
+        self.finance.candidates.get("H4NY11138")
+        candidates = self.finance.candidates.get_many(["H4NY11138", "H0TN08246"], concurrency=2)
+        self.assertEqual(len(candidates), 2)
+        self.assertEqual(self.finance.transport.requests, 2)
+
+    def test_not_found_without_json(self):
+        class HtmlNotFound(object):
+            requests = 0
+
+            def get(self, url, params=None, headers=None):
+                if 'missing' in url:
+                    return FixtureResponse(404, b'<html>Not Found</html>', {})
+                return FixtureResponse(200, b'{"status": "OK", "results": [{"id": 1}]}', {})
+        finance = NytCampfin('stub-key', transport=HtmlNotFound())
+        candidates = finance.candidates.get_many(["missing", "H4NY11138"])
+        self.assertEqual(list(candidates.keys()), ["H4NY11138"])
+        self.assertEqual(str(candidates.errors["missing"]), "HTTP 404")
+        self.assertTrue(isinstance(candidates.errors["missing"], NytNotFoundError))
+
+    def test_detail_many(self):
+        details = self.finance.president.detail_many(["obama", "C00431445"], 2008)
+        self.assertEqual(details["obama"]['path'], '/2008/president/candidates/obama.json')
+
+class DecoderTest(StubTest):
+
+    def test_lazy_client(self):
+        lazy = self.point_at_stub(NytCampfin('stub-key', decoder=lazy_loads))
+        eager = self.point_at_stub(NytCampfin('stub-key'))
+        contributions = lazy.committees.contributions("C00381277")
+        self.assertTrue(isinstance(contributions, LazyRecords))
+        self.assertEqual(contributions, eager.committees.contributions("C00381277"))
+        self.assertEqual(lazy.committees.get("C00381277"), eager.committees.get("C00381277"))
+
+    def test_records_decoded_on_access(self):
+        body = json.dumps({'num_results': 2, 'results': [{'id': 1}, {'id': 2}], 'status': 'OK'}).encode('utf-8')
+        result = lazy_loads(body)
+        self.assertEqual(result['status'], 'OK')
+        self.assertEqual(result['results']._records, [None, None])
+        self.assertEqual(result['results'][-1], {'id': 2})
+        self.assertEqual(result['results']._records, [None, {'id': 2}])
+
+    def test_compares_with_sequences_only(self):
+        body = json.dumps({'num_results': 2, 'results': [{'id': 1}, {'id': 2}]}).encode('utf-8')
+        records = lazy_loads(body)['results']
+        self.assertTrue(records == [{'id': 1}, {'id': 2}])
+        self.assertTrue(records == ({'id': 1}, {'id': 2}))
+        self.assertTrue([{'id': 1}] != records)
+        self.assertFalse(records == None)
+        self.assertTrue(records != 5)
+
+    def test_falls_back_when_split_is_unsafe(self):
+        for results in ([{'text': '}, {'}, {'id': 2}], [{'ids': [{'id': 1}]}], ['F3', 'F3X']):
+            body = json.dumps({'num_results': len(results), 'results': results}).encode('utf-8')
+            self.assertEqual(lazy_loads(body)['results'], results)
+            self.assertFalse(isinstance(lazy_loads(body)['results'], LazyRecords))
+
+class RecordTest(StubTest):
+
+    expenditure = {'fec_filing_id': 790462, 'transaction_id': 'SE.4109', 'amount': '12500.5',
+                   'date': '2012-07-03', 'support_or_oppose': 'O', 'unique_id': 'SE.4109.790462'}
+
+    def test_conversion(self):
+        ie = IndependentExpenditure.from_dict(self.expenditure)
+        self.assertEqual(ie.amount, 12500.5)
+        self.assertEqual(ie.date, datetime.date(2012, 7, 3))
+        self.assertEqual(ie.date_received, None)
+        self.assertEqual(ie['unique_id'], 'SE.4109.790462')
+        self.assertRaises(KeyError, lambda: ie['nonexistent'])
+        self.assertFalse(hasattr(ie, '__dict__'))
+
+    def test_round_trip(self):
+        ie = IndependentExpenditure.from_dict(self.expenditure)
+        data = ie.to_dict()
+        self.assertEqual(data['date'], '2012-07-03')
+        self.assertEqual(data['unique_id'], 'SE.4109.790462')
+        self.assertEqual(IndependentExpenditure.from_dict(data), ie)
+
+    def test_timestamps_round_trip(self):
+        filing = Filing.from_dict({'filing_id': '1', 'date_filed': '2012-07-05T12:34:56Z',
+                                   'date_coverage_to': '2012-06-30'})
+        self.assertEqual(filing.date_coverage_to, datetime.date(2012, 6, 30))
+        self.assertEqual(filing.to_dict()['date_filed'], '2012-07-05T12:34:56Z')
+        self.assertEqual(filing.to_dict()['date_coverage_to'], '2012-06-30')
+
+    def test_unconvertible_values_are_kept(self):
+        ie = IndependentExpenditure.from_dict({'amount': 'n/a', 'date': 'soon'})
+        self.assertEqual((ie.amount, ie.date), ('n/a', 'soon'))
+        self.assertEqual(ie.to_dict()['date'], 'soon')
+
+    def test_typed_client(self):
+        finance = self.point_at_stub(NytCampfin('stub-key', typed=True))
+        filings = finance.filings.today()
+        self.assertTrue(all(isinstance(filing, Filing) for filing in filings))
+        self.assertEqual(filings[0]['id'], 0)
+        self.assertEqual(type(finance.committees.get("C00490045")), dict)
+
+class ColumnsTest(StubTest):
+
+    expenditures = [
+        {'fec_candidate_id': 'P80003353', 'support_or_oppose': 'S', 'amount': 100.0, 'date': '2012-07-03'},
+        {'fec_candidate_id': 'P80003338', 'support_or_oppose': 'O', 'amount': 250.5, 'date': '2012-07-03'},
+        {'fec_candidate_id': 'P80003353', 'support_or_oppose': 'O', 'amount': '50', 'date': '2012-07-04'},
+        {'fec_candidate_id': None, 'support_or_oppose': 'S', 'amount': None, 'date': '2012-07-04'},
+    ]
+
+    def check_totals(self):
+        columns = Columns().extend(iter(self.expenditures))
+        self.assertEqual(len(columns), 4)
+        self.assertEqual(columns.totals_by_candidate(), {'P80003353': 150.0, 'P80003338': 250.5})
+        self.assertEqual(columns.totals_by_support_oppose(), {'S': 100.0, 'O': 300.5})
+        self.assertEqual(columns.totals_by_date(), {'2012-07-03': 350.5, '2012-07-04': 50.0})
+
+    def test_totals(self):
+        self.check_totals()
+
+    def test_totals_without_numpy(self):
+        numpy, nytcampfin.numpy = nytcampfin.numpy, None
+        try:
+            self.check_totals()
+        finally:
+            nytcampfin.numpy = numpy
+
+    def test_totals_when_first_amount_is_a_string(self):
+        self.expenditures = self.expenditures[2:] + self.expenditures[:2]
+        self.check_totals()
+        self.test_totals_without_numpy()
+
+    def test_typed_records(self):
+        columns = Columns(numeric=['amount']).extend(
+            IndependentExpenditure.from_dict(ie) for ie in self.expenditures)
+        self.assertEqual(columns.totals_by_support_oppose()['O'], 300.5)
+
+    def test_client_to_columns(self):
+        finance = self.point_at_stub(NytCampfin('stub-key'))
+        columns = finance.to_columns(finance.committees.contributions, "C00381277", bulk=True)
+        self.assertEqual(len(columns), STUB_TOTAL)
+        self.assertEqual(sum(columns['id']), sum(range(STUB_TOTAL)))
+
+class RateLimitTest(StubTest, TempDirTest):
+
+    def tearDown(self):
+        self.server.throttle = 0
+        self.server.retry_after = None
+
+    def finance(self, **options):
+        transport = Transport(backoff=0.01, **options)
+        return self.point_at_stub(NytCampfin('stub-key', transport=transport, cache=False))
+
+    def test_retry_when_throttled(self):
+        self.server.throttle = 2
+        finance = self.finance()
+        self.assertEqual(len(finance.filings.today()), 20)
+        self.assertEqual(finance.transport.retried, 2)
+
+    def test_gives_up_after_retries(self):
+        self.server.throttle = 3
+        finance = self.finance(retries=2)
+        self.assertRaises(NytCampfinError, finance.filings.today)
+
+    def test_retry_after(self):
+        self.server.throttle, self.server.retry_after = 1, 0.05
+        finance = self.finance(max_backoff=1)
+        self.assertEqual(len(finance.filings.today()), 20)
+        self.assertEqual(finance.transport.retried, 1)
+
+    def test_retry_after_over_max_backoff(self):
+        self.server.throttle, self.server.retry_after = 1, 3600
+        finance = self.finance(max_backoff=1)
+        start = time.time()
+        self.assertRaises(NytCampfinError, finance.filings.today)
+        self.assertTrue(time.time() - start < 1)
+        self.assertEqual(finance.transport.retried, 0)
+
+    def test_headroom(self):
+        finance = self.finance(limiter=RateLimiter(10))
+        finance.filings.today()
+        headroom = finance.transport.headroom()
+        self.assertEqual(headroom['day'], 4999)
+        self.assertTrue(headroom['limiter'] < 10)
+
+    def test_token_bucket(self):
+        limiter = RateLimiter(rate=100, burst=1)
+        start = time.time()
+        for i in range(5):
+            limiter.acquire()
+        self.assertTrue(time.time() - start >= 0.035)
+
+    @unittest.skipIf(os.name != 'posix', "cross-process buckets need fcntl")
+    def test_shared_bucket(self):
+        path = os.path.join(self.tmpdir, 'bucket')
+        first, second = RateLimiter(1, burst=2, path=path), RateLimiter(1, burst=2, path=path)
+        self.assertEqual(first.try_acquire(), 0)
+        self.assertEqual(second.try_acquire(), 0)
+        self.assertTrue(first.try_acquire() > 0)
+
+class FixtureTest(StubTest, TempDirTest):
+
+    def finance(self, mode, apikey='stub-key'):
+        transport = FixtureTransport(self.tmpdir, mode)
+        return NytCampfin(apikey, transport=transport, base_uri=self.base_uri)
+
+    def test_record_then_replay(self):
+        recorder = self.finance('record')
+        recorded = recorder.committees.contributions("C00381277", offset=20)
+        self.assertEqual(recorder.transport.stats(), {'requests': 1, 'recorded': 1, 'replayed': 0})
+        self.server.total = 0 # replays must not reach the server
+        try:
+            replayer = self.finance('replay', apikey='another-key')
+            self.assertEqual(replayer.committees.contributions("C00381277", offset=20), recorded)
+            self.assertEqual(replayer.transport.stats(), {'requests': 1, 'recorded': 0, 'replayed': 1})
+        finally:
+            self.server.total = STUB_TOTAL
+
+    def test_replay_without_fixture(self):
+        self.assertRaises(NytCampfinError, self.finance('replay').filings.today)
+
+    def test_errors_are_recorded(self):
+        self.assertRaises(NytNotFoundError, self.finance('once').candidates.get, "missing")
+        self.assertRaises(NytNotFoundError, self.finance('replay').candidates.get, "missing")
+
+class HookTest(StubTest):
+
+    def setUp(self):
+        self.events = []
+        self.metrics = Metrics()
+        self.finance = self.point_at_stub(NytCampfin('stub-key', hooks=[self, self.metrics]))
+
+    def tearDown(self):
+        self.server.throttle = 0
+
+    def after_request(self, event):
+        self.events.append(event)
+
+    def test_events(self):
+        self.finance.committees.get("C00490045")
+        self.finance.committees.get("C00490045")
+        miss, hit = self.events
+        self.assertEqual(miss.endpoint, "/%s/committees/%s")
+        self.assertEqual((miss.cache, hit.cache), ('miss', 'hit'))
+        self.assertEqual(miss.status, 200)
+        self.assertTrue(miss.bytes > 0 and miss.bytes == hit.bytes)
+        self.assertTrue(miss.network > 0 and hit.network is None)
+        self.assertTrue(miss.elapsed >= miss.network + miss.decode + miss.parse)
+
+    def test_revalidation_and_retries(self):
+        finance = self.point_at_stub(NytCampfin('stub-key', cache=False, hooks=[self],
+                                                transport=Transport(backoff=0.01)))
+        finance.filings.today()
+        self.server.throttle = 1
+        finance.filings.today()
+        self.assertEqual([e.cache for e in self.events], ['miss', 'revalidated'])
+        self.assertEqual([e.retries for e in self.events], [0, 1])
+
+    def test_errors(self):
+        self.assertRaises(NytNotFoundError, self.finance.candidates.get, "missing")
+        self.assertTrue(isinstance(self.events[0].error, NytNotFoundError))
+        self.assertEqual(self.metrics.report()["/%s/candidates/%s"]['errors'], 1)
+
+    def test_metrics(self):
+        for i in range(10):
+            self.finance.filings.today()
+        self.finance.filings.amendments()
+        report = self.metrics.report()
+        self.assertEqual(sorted(report), ["/%s/filings", "/%s/filings/amendments"])
+        today = report["/%s/filings"]
+        self.assertEqual(today['calls'], 10)
+        self.assertEqual(today['cache'], {'miss': 1, 'hit': 9})
+        self.assertTrue(today['p50'] <= today['p95'] <= today['p99'])
+        self.metrics.reset()
+        self.assertEqual(self.metrics.report(), {})
+
+class ExportTest(StubTest, TempDirTest):
+
+    def setUp(self):
+        super(ExportTest, self).setUp()
+        self.finance = self.point_at_stub(NytCampfin('stub-key'))
+
+    def path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def test_ndjson(self):
+        count = export(self.finance.committees.contributions, self.path('out.ndjson'), "C00381277")
+        self.assertEqual(count, STUB_TOTAL)
+        with open(self.path('out.ndjson')) as f:
+            self.assertEqual([json.loads(line)['id'] for line in f], list(range(STUB_TOTAL)))
+
+    def test_csv_gzip(self):
+        export(self.finance.indexp.candidate, self.path('out.csv.gz'), "P00003608")
+        with gzip.open(self.path('out.csv.gz'), 'rt' if str is not bytes else 'rb') as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(sorted(rows[0]), ['id', 'path'])
+        id = rows[0].index('id')
+        self.assertEqual([int(row[id]) for row in rows[1:]], list(range(STUB_TOTAL)))
+
+    def test_resume(self):
+        calls = []
+        def contributions(*args, **kwargs):
+            calls.append(kwargs['offset'])
+            if kwargs['offset'] == 40 and calls.count(40) == 1:
+                raise NytCampfinError("crashed")
+            return self.finance.committees.contributions(*args, **kwargs)
+
+        path = self.path('out.csv.gz')
+        self.assertRaises(NytCampfinError, export, contributions, path, "C00381277")
+        with open(path, 'ab') as f:
+            f.write(b'half-written page')
+        self.assertEqual(export(contributions, path, "C00381277", resume=True), STUB_TOTAL)
+        self.assertEqual(calls, [0, 20, 40, 40])
+        with gzip.open(path, 'rt' if str is not bytes else 'rb') as f:
+            self.assertEqual(len(list(csv.reader(f))), STUB_TOTAL + 1)
+        self.assertEqual(export(contributions, path, "C00381277", resume=True), STUB_TOTAL)
+        self.assertRaises(ValueError, export, contributions, path, "C00000000", resume=True)
+
+    def test_command_line(self):
+        output = subprocess.check_output([
+            sys.executable, '-m', 'nytcampfin', 'export', 'filings.by_type', 'F3',
+            '--base-uri', self.base_uri, '--apikey', 'stub-key', '-o', self.path('f3.ndjson')],
+            cwd=HERE)
+        self.assertTrue(str(STUB_TOTAL) in output.decode('utf-8'))
+        with open(self.path('f3.ndjson')) as f:
+            self.assertEqual(json.loads(next(f))['path'], '/2012/filings/types/F3.json')
+
+class CrawlTest(StubTest, TempDirTest):
+
+    def setUp(self):
+        super(CrawlTest, self).setUp()
+        self.units = list(date_units(datetime.date(2012, 7, 3), datetime.date(2012, 7, 4)))
+        self.units += committee_units(["C00490045", "missing"])
+
+    def crawl(self):
+        return Crawl(self.tmpdir, ['first-key', 'second-key'], self.units,
+                     processes=3, rate=1000, base_uri=self.base_uri)
+
+    def test_crawl(self):
+        reports = []
+        crawl = self.crawl()
+        stats = crawl.run(progress=reports.append)
+        self.assertEqual(len(reports), 10)
+        self.assertEqual((stats['units'], stats['done'], stats['failed']), (10, 8, 2))
+        self.assertEqual(stats['records'], 8 * STUB_TOTAL)
+        self.assertTrue(stats['records_per_s'] > 0)
+        self.assertEqual(sorted(crawl.errors), ['committees.contributions/missing',
+                                                'committees.filings/missing'])
+        with open(os.path.join(self.tmpdir, 'filings.date', '2012-7-4.ndjson')) as f:
+            self.assertEqual(json.loads(next(f))['path'], '/2012/filings/2012/7/4.json')
+
+    def test_rerun_skips_finished_units(self):
+        self.crawl().run()
+        crawl = self.crawl()
+        self.assertEqual([unit.name for unit in crawl.pending()],
+                         ['committees.filings/missing', 'committees.contributions/missing'])
+        stats = crawl.run()
+        self.assertEqual((stats['done'], stats['failed'], stats['records']), (8, 2, 0))
+
+    def test_default_cycle(self):
+        self.addCleanup(setattr, nytcampfin, 'CURRENT_CYCLE', nytcampfin.CURRENT_CYCLE)
+        crawl = self.crawl()
+        nytcampfin.CURRENT_CYCLE = 2010
+        crawl.run()
+        with open(os.path.join(self.tmpdir, 'filings.date', '2012-7-4.ndjson')) as f:
+            self.assertEqual(json.loads(next(f))['path'], '/2010/filings/2012/7/4.json')
+
+    def test_undecodable_pages_fail_units(self):
+        self.server.garbled = '/2012/7/4'
+        self.addCleanup(setattr, self.server, 'garbled', None)
+        crawl = self.crawl()
+        stats = crawl.run()
+        self.assertEqual((stats['units'], stats['done'], stats['failed']), (10, 5, 5))
+        self.assertEqual(crawl.errors['filings.date/2012-7-4'], 'HTTP 200: undecodable body')
+
+    def test_unreachable_api_fails_units(self):
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        base_uri = 'http://127.0.0.1:%s' % closed.getsockname()[1]
+        closed.close()
+        crawl = Crawl(self.tmpdir, ['first-key'], self.units[:3], processes=2,
+                      rate=1000, base_uri=base_uri)
+        stats = crawl.run()
+        self.assertEqual((stats['done'], stats['failed']), (0, 3))
+        self.assertEqual(len(crawl.errors), 3)
+        self.assertEqual(len(crawl.pending()), 3)
+
+class WarmStartTest(StubTest, TempDirTest):
+
+    def setUp(self):
+        super(WarmStartTest, self).setUp()
+        self.snapshot = os.path.join(self.tmpdir, 'reference.sqlite')
+
+    def worker(self):
+        finance = NytCampfin('stub-key', base_uri=self.base_uri, preload=self.snapshot)
+        finance.warm_start.stop() # waits for the refresh to finish
+        return finance
+
+    def test_cold_then_warm(self):
+        cold = self.worker()
+        self.assertEqual(cold.warm_start.loaded, 0)
+        self.assertEqual(cold.warm_start.refreshed, 4)
+        self.assertEqual(cold.transport.requests, 4 * 3)
+
+        warm = self.worker()
+        self.assertEqual(warm.warm_start.loaded, 4 * 3)
+        self.assertEqual(warm.warm_start.refreshed, 0)
+        self.assertEqual(len(list(warm.paginate(warm.committees.leadership))), STUB_TOTAL)
+        warm.filings.form_types()
+        self.assertEqual(warm.transport.requests, 0)
+        self.assertEqual(warm.filings.today()[0]['path'], '/2012/filings.json')
+        self.assertEqual(warm.transport.requests, 1)
+
+    def test_stale_entries_are_refreshed(self):
+        self.worker()
+        snapshot = nytcampfin.SqliteCache(self.snapshot)
+        for key, body, expires in snapshot.entries():
+            snapshot._set(key, body, time.time() - 1)
+        finance = NytCampfin('stub-key', base_uri=self.base_uri)
+        warm_start = WarmStart(finance, snapshot, endpoints=['filings.form_types'])
+        self.assertEqual(warm_start.load(), ['filings.form_types'])
+        warm_start.refresh(['filings.form_types'])
+        self.assertEqual(finance.transport.requests, 3)
+        self.assertEqual(warm_start.load(), [])
+
+    def test_failing_endpoint_doesnt_stop_the_rest(self):
+        finance = NytCampfin('stub-key', base_uri=self.base_uri)
+        def form_types(cycle=None, offset=0):
+            raise NytNotFoundError("not found")
+        finance.filings.form_types = form_types
+        warm_start = WarmStart(finance, self.snapshot)
+        warm_start.refresh()
+        self.assertEqual(warm_start.refreshed, 3)
+        self.assertEqual(list(warm_start.errors), ['filings.form_types'])
+        self.assertEqual(warm_start.load(), ['filings.form_types'])
+
+    def test_undecodable_endpoint_doesnt_stop_the_rest(self):
+        self.server.garbled = '/committees/leadership'
+        self.addCleanup(setattr, self.server, 'garbled', None)
+        finance = NytCampfin('stub-key', base_uri=self.base_uri)
+        warm_start = WarmStart(finance, self.snapshot)
+        warm_start.refresh()
+        self.assertEqual(warm_start.refreshed, 3)
+        self.assertEqual(list(warm_start.errors), ['committees.leadership'])
+        self.assertEqual(warm_start.load(), ['committees.leadership'])
+
+class MirrorTest(StubTest, TempDirTest):
+
+    def setUp(self):
+        super(MirrorTest, self).setUp()
+        self.finance = self.point_at_stub(NytCampfin('stub-key'))
+        self.mirror = Mirror(self.finance, os.path.join(self.tmpdir, 'mirror.sqlite'))
+
+    def tearDown(self):
+        self.mirror.close()
+
+    def test_sync_and_query(self):
+        counts = self.mirror.sync(2012)
+        units = 4 + 2 * len(nytcampfin.STATES)
+        self.assertEqual(counts, {'fetched': units, 'changed': units, 'unchanged': 0, 'skipped': 0})
+        requests = self.finance.transport.requests
+        superpacs = self.mirror.indexp.superpacs(2012)
+        self.assertEqual([r['id'] for r in superpacs], list(range(STUB_TOTAL)))
+        self.assertEqual(self.mirror.president.state('AZ', 2012)[0]['path'],
+                         '/2012/president/states/AZ.json')
+        self.assertEqual(self.mirror.candidates.seats('AZ', cycle=2010), [])
+        self.assertEqual(len(self.mirror.filings.form_types(2012)), STUB_TOTAL)
+        self.assertEqual(len(self.mirror.president.state('AZ', 2012)), STUB_TOTAL)
+        self.assertEqual(self.finance.transport.requests, requests)
+
+    def test_incremental_sync(self):
+        self.mirror.sync(2012, resources=['committees.leadership', 'filings.form_types'])
+        self.assertEqual(self.mirror.sync(2012, resources=['filings.form_types']),
+                         {'fetched': 0, 'changed': 0, 'unchanged': 0, 'skipped': 1})
+        self.mirror.client = self.point_at_stub(NytCampfin('stub-key', cache=False))
+        self.assertEqual(self.mirror.sync(2012, resources=['committees.leadership'], max_age=0),
+                         {'fetched': 1, 'changed': 0, 'unchanged': 1, 'skipped': 0})
+
+    def test_cycle_as_string(self):
+        self.mirror.sync('2012', resources=['filings.form_types'])
+        self.assertEqual(self.mirror.sync('2012', resources=['filings.form_types']),
+                         {'fetched': 0, 'changed': 0, 'unchanged': 0, 'skipped': 1})
+        self.assertEqual(len(self.mirror.query('filings.form_types', '2012')), STUB_TOTAL)
+        self.assertEqual(list(self.mirror.lookup('3', '2012')), ['filings.form_types'])
+
+    def test_lookup(self):
+        self.mirror.sync(2012, resources=['president.candidates', 'filings.form_types'])
+        found = self.mirror.lookup('3')
+        self.assertEqual(sorted(found), ['filings.form_types', 'president.candidates'])
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file